@@ -0,0 +1,158 @@
+import multiprocessing
+
+BUSY = "ER Server is busy, try again later."
+
+
+class Gate:
+    """
+    Counts the holders of a limited resource (connections, forwarded requests)
+    across all processes of a server.
+
+    Up to `limit` holders enter at once, up to `queue_size` more may wait for a
+    slot for at most `timeout` seconds, everyone else is rejected at once. The
+    counters live in shared memory, so a gate created before the server processes
+    start is shared by all of them. A limit of 0 only counts.
+    """
+
+    def __init__(self, limit, queue_size=0, timeout=5.0):
+        """
+        Args:
+            limit (int): Maximum number of holders, 0 for no limit.
+            queue_size (int): Maximum number of callers waiting for a slot.
+            timeout (float): Seconds a caller waits for a slot before it is rejected.
+        """
+        self.limit = max(0, int(limit))
+        self.queue_size = max(0, int(queue_size))
+        self.timeout = timeout
+        self.cond = multiprocessing.Condition()
+        self.active = multiprocessing.RawValue("i", 0)
+        self.waiting = multiprocessing.RawValue("i", 0)
+        self.rejected = multiprocessing.RawValue("q", 0)
+
+    def try_enter(self, queued=False):
+        """
+        Takes a slot if one is free and nobody is waiting for it (unless the caller is queued itself).
+
+        Returns:
+            bool: True if the slot was taken.
+        """
+        with self.cond:
+            if self.limit and (self.active.value >= self.limit or (self.waiting.value and not queued)):
+                return False
+            self.active.value += 1
+            return True
+
+    def enter(self):
+        """
+        Takes a slot, waiting in the queue if necessary.
+
+        Returns:
+            bool: True if the slot was taken, False if the caller was rejected.
+        """
+        if self.try_enter():
+            return True
+        if not self.join_queue():
+            return False
+
+        with self.cond:
+            try:
+                if self.cond.wait_for(lambda: self.active.value < self.limit, self.timeout):
+                    self.active.value += 1
+                    return True
+                self.rejected.value += 1
+                return False
+            finally:
+                self.waiting.value -= 1
+
+    def leave(self):
+        """
+        Returns a slot and wakes up a waiting caller.
+        """
+        with self.cond:
+            self.active.value -= 1
+            self.cond.notify()
+
+    def join_queue(self):
+        """
+        Counts a caller as waiting for a slot.
+
+        Returns:
+            bool: False (and the caller is counted as rejected) if the queue is full.
+        """
+        with self.cond:
+            if self.waiting.value >= self.queue_size:
+                self.rejected.value += 1
+                return False
+            self.waiting.value += 1
+            return True
+
+    def leave_queue(self, rejected=False):
+        """
+        Stops counting a caller as waiting, after it got a slot or gave up.
+        """
+        with self.cond:
+            self.waiting.value -= 1
+            if rejected:
+                self.rejected.value += 1
+
+    def status(self):
+        with self.cond:
+            return {
+                "active": self.active.value,
+                "limit": self.limit,
+                "waiting": self.waiting.value,
+                "rejected": self.rejected.value,
+            }
+
+
+class Admission:
+    """
+    Admission control of one server: concurrent connections, connections per
+    client IP and forwarded requests in flight.
+    """
+
+    def __init__(self, max_connections=0, max_per_ip=0, max_forwards=0, queue_size=0, queue_timeout=5.0):
+        """
+        Args:
+            max_connections (int): Concurrent connections, 0 for no limit.
+            max_per_ip (int): Concurrent connections of one client IP, 0 for no limit.
+                Counted per accepting process.
+            max_forwards (int): Forwarded requests in flight, 0 for no limit.
+            queue_size (int): Connections and forwards that may wait for a slot.
+            queue_timeout (float): Seconds they wait before they are rejected.
+        """
+        self.connections = Gate(max_connections, queue_size, queue_timeout)
+        self.forwards = Gate(max_forwards, queue_size, queue_timeout)
+        self.max_per_ip = max(0, int(max_per_ip))
+        self.per_ip_rejected = multiprocessing.Value("q", 0)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_connections=config["max_connections"],
+            max_per_ip=config["max_connections_per_ip"],
+            max_forwards=config["max_forwards"],
+            queue_size=config["admission_queue_size"],
+            queue_timeout=config["admission_queue_timeout"]
+        )
+
+    def ip_allowed(self, count):
+        """
+        Returns True if a client IP with `count` open connections may open another one.
+        A refusal is counted as rejected.
+        """
+        if self.max_per_ip and count >= self.max_per_ip:
+            with self.per_ip_rejected.get_lock():
+                self.per_ip_rejected.value += 1
+            return False
+        return True
+
+    def status(self):
+        """
+        Returns the occupancy of all limits as a dict.
+        """
+        return {
+            "connections": self.connections.status(),
+            "per_ip": {"limit": self.max_per_ip, "rejected": self.per_ip_rejected.value},
+            "forwards": self.forwards.status(),
+        }
@@ -0,0 +1,188 @@
+import asyncio
+import collections
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from command import Commands, PROFILER
+from config_loader import load_config
+from protocol import Session, LineTooLongError, RECV_SIZE
+from admission import BUSY
+
+CONFIG = load_config()
+CLIENT_TIMEOUT = CONFIG["client_timeout"]
+ASYNC_THREADS = CONFIG["async_threads"]
+DRAIN_TIMEOUT = CONFIG["drain_timeout"]
+# Seconds between attempts of a queued connection to take a free slot.
+ADMISSION_POLL = 0.01
+
+
+def process(session, commands, data, client_ip):
+    """
+    Runs one read's worth of commands in an executor thread, profiled while PROFILER is active.
+    """
+    with PROFILER.profile():
+        return session.process(commands, data, client_ip)
+
+
+async def serve_client(reader, writer, commands):
+    """
+    Handles a single client connection on the event loop.
+    Commands run in the executor so a slow forward does not stall other clients.
+    All commands completed by one read are executed together and answered with one write.
+    If the connection times out due to inactivity, sends a notification message
+    to the client before closing the connection.
+
+    Args:
+        reader (asyncio.StreamReader): Client input stream.
+        writer (asyncio.StreamWriter): Client output stream.
+        commands (Commands): Shared command dispatcher.
+    """
+    loop = asyncio.get_running_loop()
+    client_ip = writer.get_extra_info("peername")[0]
+    session = Session()
+
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(reader.read(RECV_SIZE), CLIENT_TIMEOUT)
+            except asyncio.TimeoutError:
+                writer.write(b"TIMEOUT: Connection closed due to inactivity.\r\n")
+                await writer.drain()
+                break
+
+            if not data:
+                break
+
+            try:
+                response = await loop.run_in_executor(None, process, session, commands, data, client_ip)
+            except LineTooLongError as e:
+                writer.write(f"{e}\r\n".encode())
+                await writer.drain()
+                break
+
+            if response:
+                writer.write(response)
+                await writer.drain()
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    finally:
+        writer.close()
+
+
+async def admit(gate):
+    """
+    Takes a connection slot of the gate, waiting in its queue if necessary.
+
+    Returns:
+        bool: False if the connection was rejected.
+    """
+    if gate.try_enter():
+        return True
+    if not gate.join_queue():
+        return False
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + gate.timeout
+    admitted = False
+    try:
+        while not admitted and loop.time() < deadline:
+            await asyncio.sleep(ADMISSION_POLL)
+            admitted = gate.try_enter(queued=True)
+    finally:
+        gate.leave_queue(rejected=not admitted)
+    return admitted
+
+
+async def refuse(writer):
+    """
+    Answers a connection that is not admitted with the busy response and closes it.
+    """
+    try:
+        writer.write(f"{BUSY}\r\n".encode())
+        await writer.drain()
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(lock, host=None, port=None, sock=None, ready=None, admission=None):
+    """
+    Starts the listener and serves all clients from the current process.
+    On SIGTERM stops accepting, ends every connection after the commands it has
+    in flight and waits up to DRAIN_TIMEOUT seconds for them.
+    With admission control, connections over the per-IP limit are refused, over
+    the connection limit they wait in the admission queue or are refused.
+
+    Args:
+        lock (StripedLock): Shared re-entrant lock with per-account stripes.
+        host (str, optional): Address to bind to.
+        port (int, optional): Port to listen on.
+        sock (socket.socket, optional): Already bound listening socket, used instead of host and port.
+        ready (callable, optional): Called with the bound host and port once clients are accepted.
+        admission (Admission, optional): Limits of the server, shared with other workers.
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_THREADS))
+    commands = Commands(lock, admission)
+    clients = {}
+    per_ip = collections.Counter()
+    stopping = asyncio.Event()
+
+    async def admitted_client(reader, writer):
+        ip = writer.get_extra_info("peername")[0]
+        if not admission.ip_allowed(per_ip[ip]):
+            await refuse(writer)
+            return
+
+        per_ip[ip] += 1
+        try:
+            if not await admit(admission.connections):
+                await refuse(writer)
+                return
+            try:
+                await serve_client(reader, writer, commands)
+            finally:
+                admission.connections.leave()
+        finally:
+            per_ip[ip] -= 1
+            if not per_ip[ip]:
+                del per_ip[ip]
+
+    async def client(reader, writer):
+        task = asyncio.current_task()
+        clients[task] = reader
+        try:
+            if admission is None:
+                await serve_client(reader, writer, commands)
+            else:
+                await admitted_client(reader, writer)
+        finally:
+            clients.pop(task, None)
+
+    server = await asyncio.start_server(client, host=host, port=port, sock=sock)
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    except (NotImplementedError, RuntimeError):
+        # No signal handlers on Windows event loops or outside the main thread.
+        pass
+
+    if ready is not None:
+        ready(*server.sockets[0].getsockname()[:2])
+
+    try:
+        await stopping.wait()
+        server.close()
+        for reader in clients.values():
+            reader.feed_eof()
+        if clients:
+            await asyncio.wait(list(clients), timeout=DRAIN_TIMEOUT)
+    finally:
+        server.close()
+        commands.close()
+
+
+def run_async_server(lock, host=None, port=None, sock=None, ready=None, admission=None):
+    """
+    Runs the event-loop server until the process is terminated or receives SIGTERM.
+    """
+    asyncio.run(serve(lock, host, port, sock, ready, admission))
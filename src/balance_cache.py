@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class BalanceCache:
+    """
+    Short-lived cache of balances of accounts on other banks.
+
+    Every key has a version that is bumped on invalidation. A reader takes the
+    version before forwarding AB and stores the answer only if the version is still
+    the same, so a balance read while a deposit or withdrawal was forwarded is never
+    cached after that change. The oldest entries are dropped beyond max_entries.
+    """
+
+    def __init__(self, ttl=1.0, max_entries=10000):
+        """
+        Args:
+            ttl (float): Seconds a balance is served from the cache, 0 disables the cache.
+            max_entries (int): Maximum number of cached balances.
+        """
+        self.ttl = ttl
+        self.max_entries = max(1, int(max_entries))
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.versions = {}
+        self.epoch = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key):
+        """
+        Returns the cached response for a key, or None if it is missing or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self.entries[key]
+                return None
+            return entry[0]
+
+    def version(self, key):
+        """
+        Returns the current version of a key, to be passed to put().
+        """
+        with self.lock:
+            return self.epoch, self.versions.get(key, 0)
+
+    def put(self, key, response, version):
+        """
+        Caches a response unless the key was invalidated since version() was called.
+        """
+        with self.lock:
+            if (self.epoch, self.versions.get(key, 0)) != version:
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = (response, time.monotonic() + self.ttl)
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
+
+    def invalidate(self, key):
+        """
+        Drops the cached balance of a key and rejects answers of reads already in flight.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            if key in self.versions or len(self.versions) < self.max_entries:
+                self.versions[key] = self.versions.get(key, 0) + 1
+            else:
+                # Too many versions are kept, start over and reject every read in flight.
+                self.epoch += 1
+                self.entries.clear()
+                self.versions.clear()
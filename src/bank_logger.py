@@ -0,0 +1,160 @@
+import atexit
+import os
+import queue
+import threading
+
+_STOP = object()
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class LogWriter:
+    """
+    Background log writer.
+    Records are put into a queue and a writer thread appends them to the file in
+    batches, so connection handlers never wait for the file system. Records keep
+    the order in which they were written. The file is rotated when it grows over
+    max_bytes.
+    """
+
+    def __init__(self, path, lock=None, flush_interval=0.2, batch_size=500,
+                 queue_size=10000, policy="block", max_bytes=10485760, backups=5):
+        """
+        Args:
+            path (str): Log file path.
+            lock (multiprocessing.RLock, optional): Lock shared by processes writing the
+                same file, held only while rotating.
+            flush_interval (float): Maximum seconds a record waits before it is written.
+            batch_size (int): Maximum number of records written at once.
+            queue_size (int): Maximum number of records waiting in the queue.
+            policy (str): "block" waits for free space when the queue is full,
+                "drop" discards the record and counts it in dropped.
+            max_bytes (int): Size after which the file is rotated, 0 disables rotation.
+            backups (int): Number of rotated files to keep (bank.log.1 ... bank.log.N).
+        """
+        self.path = path
+        self.lock = lock
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, int(batch_size))
+        self.queue_size = queue_size
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.backups = max(1, int(backups))
+        self.dropped = 0
+        self.pid = None
+        self.thread = None
+        self.queue = None
+
+    def write(self, record):
+        """
+        Queues one record (a complete line including the newline).
+        """
+        self._ensure_started()
+        if self.policy == "drop":
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+        else:
+            self.queue.put(record)
+
+    def close(self):
+        """
+        Writes all queued records and stops the writer thread.
+        """
+        if self.thread is None or self.pid != os.getpid():
+            return
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.thread = None
+
+    def _ensure_started(self):
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            stop = first is _STOP
+            if not stop:
+                batch.append(first)
+
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stop = True
+                else:
+                    batch.append(record)
+
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(batch))
+                size = f.tell()
+        except OSError:
+            return
+
+        if self.max_bytes and size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        if self.lock is not None:
+            with self.lock:
+                self._rotate_files()
+        else:
+            self._rotate_files()
+
+    def _rotate_files(self):
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        except OSError:
+            pass
+
+
+def get_writer(path, **options):
+    """
+    Returns the LogWriter of the current process for the given file,
+    so all command handlers in one process share one queue and keep their order.
+    """
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = LogWriter(path, **options)
+            _writers[path] = writer
+        return writer
+
+
+def close_all():
+    """
+    Flushes and stops all writers of the current process.
+    """
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.close()
+
+
+atexit.register(close_all)
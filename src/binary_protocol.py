@@ -0,0 +1,196 @@
+import socket
+import struct
+
+NEGOTIATE = "BP 1"
+
+OPCODES = {"TX": 0, "BC": 1, "AC": 2, "AD": 3, "AW": 4, "AB": 5, "AR": 6, "BA": 7, "BN": 8, "BR": 9}
+NAMES = {code: name for name, code in OPCODES.items()}
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_TEXT = 2
+
+LENGTH = struct.Struct(">I")
+HEADER = struct.Struct(">BB")
+ACCOUNT = struct.Struct(">I4s")
+AMOUNT = struct.Struct(">q")
+
+ACCOUNT_COMMANDS = ("AB", "AR")
+AMOUNT_COMMANDS = ("AD", "AW")
+NUMBER_RESPONSES = ("AB", "BA", "BN")
+IP_RESPONSES = ("BC", "BR")
+EMPTY_RESPONSES = ("AD", "AW", "AR")
+# Largest payload sent or accepted, large enough for the response of any BT batch.
+MAX_FRAME = 16 * 1024 * 1024
+# Expected payload length of each fixed-width request.
+REQUEST_SIZES = {
+    **{name: 1 + ACCOUNT.size for name in ACCOUNT_COMMANDS},
+    **{name: 1 + ACCOUNT.size + AMOUNT.size for name in AMOUNT_COMMANDS},
+}
+
+
+class FrameTooLongError(ValueError):
+    """
+    Raised when a frame is longer than the sender or the receiver allows.
+    """
+
+
+def frame(payload):
+    """
+    Prefixes a payload with its 4-byte big-endian length.
+
+    Raises:
+        FrameTooLongError: If the payload exceeds MAX_FRAME.
+    """
+    if len(payload) > MAX_FRAME:
+        raise FrameTooLongError("ER Message is too long.")
+    return LENGTH.pack(len(payload)) + payload
+
+
+def next_frame(buffer, max_length=MAX_FRAME):
+    """
+    Removes one complete frame from the start of the buffer.
+
+    Args:
+        buffer (bytearray): Received bytes, consumed in place.
+        max_length (int): Longest payload accepted.
+
+    Returns:
+        bytes: The frame payload, or None if the frame is not complete yet.
+
+    Raises:
+        FrameTooLongError: If the announced length exceeds max_length.
+    """
+    if len(buffer) < LENGTH.size:
+        return None
+    (length,) = LENGTH.unpack_from(buffer)
+    if length > max_length:
+        buffer.clear()
+        raise FrameTooLongError("ER Command is too long.")
+    end = LENGTH.size + length
+    if len(buffer) < end:
+        return None
+    payload = bytes(buffer[LENGTH.size:end])
+    del buffer[:end]
+    return payload
+
+
+def pack_account(key):
+    """
+    Packs an account key into its fixed-width form.
+
+    Raises:
+        ValueError: If the key does not survive the round trip unchanged (e.g. "012345"
+            or "10.1"), such keys must be sent as text.
+    """
+    number, ip = key.split("/")
+    packed = ACCOUNT.pack(int(number), socket.inet_aton(ip))
+    if str(int(number)) != number or socket.inet_ntoa(packed[4:]) != ip:
+        raise ValueError(f"Account key {key} is not canonical.")
+    return packed
+
+
+def unpack_account(payload, offset):
+    number, ip = ACCOUNT.unpack_from(payload, offset)
+    return f"{number}/{socket.inet_ntoa(ip)}"
+
+
+def encode_request(command):
+    """
+    Encodes a text command as a binary request frame.
+    Commands without a fixed-width form (or with unusual arguments, e.g. account keys
+    or amounts that would not decode to the same text) are sent as text.
+    """
+    parts = command.split()
+    cmd = parts[0].upper() if parts else ""
+
+    try:
+        if cmd in ACCOUNT_COMMANDS and len(parts) == 2:
+            return frame(bytes([OPCODES[cmd]]) + pack_account(parts[1]))
+        if cmd in AMOUNT_COMMANDS and len(parts) == 3:
+            if str(int(parts[2])) == parts[2]:
+                return frame(bytes([OPCODES[cmd]]) + pack_account(parts[1]) + AMOUNT.pack(int(parts[2])))
+        if cmd in OPCODES and cmd != "TX" and len(parts) == 1:
+            return frame(bytes([OPCODES[cmd]]))
+    except (ValueError, OSError, struct.error):
+        pass
+
+    return frame(bytes([OPCODES["TX"]]) + command.encode())
+
+
+def decode_request(payload):
+    """
+    Decodes a binary request payload into the equivalent text command.
+
+    Returns:
+        tuple: (opcode, text command).
+
+    Raises:
+        ValueError: If the payload length does not match the opcode.
+    """
+    opcode = payload[0]
+    name = NAMES.get(opcode)
+
+    if name is None:
+        return opcode, ""
+    if name == "TX":
+        return opcode, payload[1:].decode(errors="replace")
+    if len(payload) != REQUEST_SIZES.get(name, 1):
+        raise ValueError("ER Malformed frame.")
+    if name in ACCOUNT_COMMANDS:
+        return opcode, f"{name} {unpack_account(payload, 1)}"
+    if name in AMOUNT_COMMANDS:
+        (amount,) = AMOUNT.unpack_from(payload, 1 + ACCOUNT.size)
+        return opcode, f"{name} {unpack_account(payload, 1)} {amount}"
+    return opcode, name
+
+
+def encode_response(opcode, response):
+    """
+    Encodes a text response to a request with the given opcode as a binary frame.
+    """
+    name = NAMES.get(opcode)
+    parts = response.split()
+
+    if response.startswith("ER"):
+        return frame(HEADER.pack(STATUS_ERROR, opcode) + response.encode())
+
+    try:
+        if name in NUMBER_RESPONSES and len(parts) == 2:
+            return frame(HEADER.pack(STATUS_OK, opcode) + AMOUNT.pack(int(parts[1])))
+        if name in IP_RESPONSES and len(parts) == 2:
+            return frame(HEADER.pack(STATUS_OK, opcode) + socket.inet_aton(parts[1]))
+        if name == "AC" and len(parts) == 2:
+            return frame(HEADER.pack(STATUS_OK, opcode) + pack_account(parts[1]))
+        if name in EMPTY_RESPONSES and parts == [name]:
+            return frame(HEADER.pack(STATUS_OK, opcode))
+    except (ValueError, OSError, struct.error):
+        pass
+
+    try:
+        return frame(HEADER.pack(STATUS_TEXT, opcode) + response.encode())
+    except FrameTooLongError as e:
+        return frame(HEADER.pack(STATUS_ERROR, opcode) + str(e).encode())
+
+
+def decode_response(payload):
+    """
+    Decodes a binary response payload into the equivalent text response.
+    A malformed payload is returned as an ER response.
+    """
+    try:
+        status, opcode = HEADER.unpack_from(payload)
+        body = payload[HEADER.size:]
+        name = NAMES.get(opcode)
+
+        if status != STATUS_OK:
+            return body.decode(errors="replace")
+        if name in NUMBER_RESPONSES:
+            return f"{name} {AMOUNT.unpack(body)[0]}"
+        if name in IP_RESPONSES:
+            return f"{name} {socket.inet_ntoa(body)}"
+        if name == "AC":
+            return f"AC {unpack_account(body, 0)}"
+        return name
+    except (ValueError, OSError, struct.error):
+        return "ER Malformed response from bank."
@@ -1,38 +1,169 @@
-import random
 import socket
-import json
 import os
 import datetime
+import contextlib
+import importlib
+import json
+import threading
+import time
 from config_loader import load_config
+from storage import AccountSpaceExhaustedError
+from group_commit import GroupCommit
+from locks import StripedLock
+from peer_pool import PeerPool, PeerBusyError
+from discovery import PortDiscovery
+from identity import BankIdentity
+from forwarder import Forwarder
+from metrics import Metrics, read_metrics, reset_metrics
+from profiler import Profiler
+from balance_cache import BalanceCache
+import bank_logger
 
 FILE = "accounts.json"
 CONFIG = load_config()
+# bank.log, metrics and profiles, by default in a 'log' directory sibling to the 'src' directory.
+LOG_DIR = os.path.abspath(CONFIG["log_dir"] or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log"))
 P2P_TIMEOUT = CONFIG["p2p_timeout"]
-BASE_PORT = CONFIG["port"]
+BASE_PORT = CONFIG["peer_base_port"] or CONFIG["port"]
+COMPACT_EVERY = CONFIG["compact_every"]
+# Account store backends selectable with "storage" in the config as (module, class),
+# imported by open_store() so only the configured backend is loaded.
+STORES = {
+    "journal": ("storage", "AccountStore"),
+    "mmap": ("record_store", "RecordStore"),
+    "sqlite": ("sqlite_store", "SQLiteStore")
+}
+STORAGE = CONFIG["storage"]
+DURABILITY = CONFIG["durability"]
+SLOW_COMMAND_MS = CONFIG["slow_command_ms"]
+PROFILE_WINDOW = CONFIG["profile_window"]
+METRICS = Metrics(
+    enabled=CONFIG["metrics"],
+    dump_interval=CONFIG["metrics_dump_interval"]
+)
+PROFILER = Profiler(os.path.join(LOG_DIR, "profile"))
+BALANCE_CACHE = BalanceCache(
+    ttl=CONFIG["balance_cache_ttl"],
+    max_entries=CONFIG["balance_cache_size"]
+)
+PEER_POOL = PeerPool(
+    max_per_peer=CONFIG["peer_pool_size"],
+    idle_timeout=CONFIG["peer_idle_timeout"],
+    timeout=P2P_TIMEOUT,
+    binary=CONFIG["binary_forwarding"]
+)
+BANK_IDENTITY = BankIdentity(
+    pinned=CONFIG["bank_ip"],
+    check_interval=CONFIG["ip_check_interval"]
+)
+DISCOVERY = PortDiscovery(
+    range(BASE_PORT, BASE_PORT + 11),
+    ttl=CONFIG["peer_port_ttl"],
+    dead_ttl=CONFIG["peer_dead_ttl"],
+    timeout=P2P_TIMEOUT
+)
+
+
+def open_store(lock):
+    """
+    Creates the account store selected by "storage" in the config.
 
+    Every backend is created as backend(path, lock=..., compact_every=..., metrics=...,
+    group_commit=...) and offers get(key), create(ip), set(key, balance), delete(key), apply(changes),
+    total(), count(), verify(), snapshot(), sync(), compact() and close(). Callers
+    hold the account's stripe lock around a get() followed by a set() or delete().
+    With "durability": "group" every mutation returns only after it is on disk,
+    concurrent mutations share one fsync.
 
-def load_accounts():
-    """
-    Loads the account database from the JSON file.
+    Args:
+        lock (StripedLock): Lock shared by all processes using the store.
 
-    Returns:
-        dict: Dictionary of accounts {key: balance}.
+    Raises:
+        ValueError: If the configured backend or durability mode is unknown.
     """
-    if not os.path.exists(FILE):
-        return {}
-    with open(FILE, "r") as f:
-        return json.load(f)
+    if STORAGE not in STORES:
+        raise ValueError(f"Unknown storage backend: {STORAGE}")
+    if DURABILITY not in ("none", "group"):
+        raise ValueError(f"Unknown durability mode: {DURABILITY}")
+    module, name = STORES[STORAGE]
+    backend = getattr(importlib.import_module(module), name)
+
+    group_commit = GroupCommit(
+        window=CONFIG["group_commit_window"],
+        max_batch=CONFIG["group_commit_max_batch"],
+        metrics=METRICS
+    ) if DURABILITY == "group" else None
 
+    return backend(FILE, lock=lock, compact_every=COMPACT_EVERY, metrics=METRICS, group_commit=group_commit)
 
-def save_accounts(accounts):
+
+def forward_lines(target_ip, commands):
+    """
+    Sends commands to a target IP address over one connection and returns one response per command.
+    The peer's port is taken from DISCOVERY, on a miss the ports from BASE_PORT
+    to BASE_PORT + 10 are probed concurrently. Connections are taken from the
+    shared PEER_POOL and kept open for reuse. A peer whose connection fails in
+    any other way than a refused connect or a timeout is marked dead.
+    Uses the P2P_TIMEOUT constant for socket operations.
     """
-    Saves the current state of accounts to the JSON file.
+    if DISCOVERY.is_dead(target_ip):
+        return ["ER Bank unreachable"] * len(commands)
 
-    Args:
-        accounts (dict): Dictionary of accounts to save.
+    port = DISCOVERY.lookup(target_ip)
+
+    if port is not None:
+        try:
+            return PEER_POOL.request_many(target_ip, port, commands)
+        except PeerBusyError:
+            return ["ER Bank is busy"] * len(commands)
+        except ConnectionRefusedError:
+            DISCOVERY.invalidate(target_ip)
+        except socket.timeout:
+            DISCOVERY.invalidate(target_ip)
+            return ["ER Bank unreachable"] * len(commands)
+        except OSError:
+            DISCOVERY.mark_dead(target_ip)
+            return ["ER Bank unreachable"] * len(commands)
+
+    found = DISCOVERY.probe(target_ip)
+    if found is None:
+        return ["ER Bank unreachable"] * len(commands)
+
+    port, sock = found
+    PEER_POOL.adopt(target_ip, port, sock)
+
+    try:
+        return PEER_POOL.request_many(target_ip, port, commands)
+    except PeerBusyError:
+        return ["ER Bank is busy"] * len(commands)
+    except (ConnectionRefusedError, socket.timeout):
+        DISCOVERY.invalidate(target_ip)
+        return ["ER Bank unreachable"] * len(commands)
+    except OSError:
+        DISCOVERY.mark_dead(target_ip)
+        return ["ER Bank unreachable"] * len(commands)
+
+
+def peer_metric(target_ip):
+    """
+    Returns the histogram prefix of a peer bank. Everything that is not a dotted-quad
+    IPv4 address is counted as "peer.other", so junk keys sent by clients do not
+    create new histograms.
     """
-    with open(FILE, "w") as f:
-        json.dump(accounts, f)
+    try:
+        if socket.inet_ntoa(socket.inet_aton(target_ip)) == target_ip:
+            return f"peer.{target_ip}"
+    except OSError:
+        pass
+    return "peer.other"
+
+
+FORWARDER = Forwarder(
+    forward_lines,
+    window=CONFIG["forward_window"],
+    max_batch=CONFIG["forward_max_batch"],
+    timeout=CONFIG["forward_timeout"]
+) if CONFIG["forward_coalescing"] else None
 
 
 class Commands:
@@ -40,15 +171,23 @@ class Commands:
     Class encapsulating banking operation logic, P2P communication, and logging.
     """
 
-    def __init__(self, lock):
+    def __init__(self, lock, admission=None):
         """
         Initializes the commands instance and sets up the logging directory.
-        The log file is located in a 'log' directory sibling to the 'src' directory.
+        The log file is located in LOG_DIR ("log_dir" in the config).
 
         Args:
-            lock (multiprocessing.RLock): Lock for safe file access.
+            lock (StripedLock | multiprocessing.RLock): Lock for safe file access. A StripedLock
+                additionally provides per-account locks, a plain lock guards every account.
+            admission (Admission, optional): Limits of the server, bounds the forwarded
+                requests in flight and is reported by LD.
         """
+        if not isinstance(lock, StripedLock):
+            lock = StripedLock(0, lock)
         self.lock = lock
+        self.admission = admission
+        self.local = threading.local()
+        self.store = open_store(lock)
         self.commands = {
             "BC": self.bank_code,
             "AC": self.account_create,
@@ -58,11 +197,17 @@ class Commands:
             "AR": self.account_remove,
             "BA": self.bank_total,
             "BN": self.bank_number,
+            "BR": self.bank_refresh,
+            "BT": self.batch,
+            "ST": self.stats,
+            "PF": self.profile,
+            "LD": self.load,
         }
 
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self.log_dir = os.path.join(base_dir, "log")
+        self.log_dir = LOG_DIR
         self.log_file = os.path.join(self.log_dir, "bank.log")
+        # One file per node, several banks may run from the same checkout.
+        self.metrics_file = os.path.join(self.log_dir, f"metrics-{CONFIG['port']}.json")
 
         if not os.path.exists(self.log_dir):
             try:
@@ -70,9 +215,35 @@ class Commands:
             except OSError:
                 pass
 
+        self.logger = bank_logger.get_writer(
+            self.log_file,
+            lock=lock,
+            flush_interval=CONFIG["log_flush_interval"],
+            batch_size=CONFIG["log_batch_size"],
+            queue_size=CONFIG["log_queue_size"],
+            policy=CONFIG["log_queue_policy"],
+            max_bytes=CONFIG["log_max_bytes"],
+            backups=CONFIG["log_backups"]
+        )
+
+    def reset_metrics(self):
+        """
+        Drops the statistics of previous runs of this node, called at server start.
+        """
+        reset_metrics(self.metrics_file)
+
+    def close(self):
+        """
+        Flushes pending log records, metrics and profiles and closes the account store.
+        """
+        METRICS.flush(self.metrics_file, self.lock)
+        PROFILER.dump()
+        self.logger.close()
+        self.store.close()
+
     def log_event(self, addr, direction, message):
         """
-        Appends a log entry to the log file.
+        Queues a log entry for the background log writer.
 
         Args:
             addr (str): The address associated with the event.
@@ -82,9 +253,7 @@ class Commands:
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         log_entry = f"[{timestamp}] {addr} [{direction}]: {message}\n"
 
-        with self.lock:
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(log_entry)
+        self.logger.write(log_entry)
 
     def send_response(self, conn, msg, addr):
         """
@@ -95,12 +264,15 @@ class Commands:
             msg (str): Message to send.
             addr (str): Recipient address for logging.
         """
+        self.local.outcome = "ER" if msg.startswith("ER") else "OK"
         self.log_event(addr, "OUT", msg)
         conn.sendall((msg + "\r\n").encode())
 
     def execute(self, message, conn, addr="UNKNOWN"):
         """
         Parses and executes an incoming command, logging both request and response.
+        Commands slower than "slow_command_ms" are logged as SLOW with the time
+        spent waiting for locks, on storage I/O and on each peer bank.
 
         Args:
             message (str): Received text command.
@@ -110,6 +282,9 @@ class Commands:
         if not message:
             return
 
+        start = time.perf_counter()
+        if SLOW_COMMAND_MS:
+            METRICS.begin_trace()
         self.log_event(addr, "IN", message)
 
         parts = message.split()
@@ -118,14 +293,49 @@ class Commands:
 
         if cmd not in self.commands:
             self.send_response(conn, "ER Unknown command", addr)
+            METRICS.observe("cmd.UNKNOWN.ER", time.perf_counter() - start)
+            if SLOW_COMMAND_MS:
+                METRICS.end_trace()
             return
 
+        self.local.outcome = "OK"
         try:
             self.commands[cmd](conn, args, addr)
         except Exception as e:
             error_msg = f"ER Application error: {e}"
             self.send_response(conn, error_msg, addr)
 
+        elapsed = time.perf_counter() - start
+        if SLOW_COMMAND_MS:
+            spans = METRICS.end_trace()
+            if elapsed * 1000 >= SLOW_COMMAND_MS:
+                self.log_slow(addr, message, elapsed, spans)
+        METRICS.observe(f"cmd.{cmd}.{self.local.outcome}", elapsed)
+        METRICS.maybe_flush(self.metrics_file, self.lock)
+
+    def log_slow(self, addr, message, elapsed, spans):
+        """
+        Logs a slow command with its total time and the parts it was spent on.
+
+        Args:
+            addr (str): Source identifier for logging.
+            message (str): The slow command.
+            elapsed (float): Total execution time in seconds.
+            spans (dict): Name -> seconds observed while the command ran.
+        """
+        parts = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in sorted(spans.items()))
+        self.log_event(addr, "SLOW", f"{message} took {elapsed * 1000:.1f} ms ({parts or 'no breakdown'})")
+
+    @contextlib.contextmanager
+    def key_lock(self, *keys):
+        """
+        Holds the stripe locks of the given accounts and records the time spent waiting for them.
+        """
+        start = time.perf_counter()
+        with self.lock.for_keys(keys):
+            METRICS.observe("lock.wait", time.perf_counter() - start)
+            yield
+
     def bank_code(self, conn, args, addr):
         """
         Sends the bank's IP address to the client.
@@ -135,20 +345,15 @@ class Commands:
     def account_create(self, conn, args, addr):
         """
         Creates a new unique account number associated with the current bank IP.
+        The number is taken from the store's allocator of unused numbers.
         """
-        ip = self.get_my_ip()
-
-        with self.lock:
-            accounts = load_accounts()
+        try:
+            key = self.store.create(self.get_my_ip())
+        except AccountSpaceExhaustedError as e:
+            self.send_response(conn, str(e), addr)
+            return
 
-            while True:
-                acc = random.randint(10000, 99999)
-                key = f"{acc}/{ip}"
-                if key not in accounts:
-                    accounts[key] = 0
-                    save_accounts(accounts)
-                    self.send_response(conn, f"AC {key}", addr)
-                    return
+        self.send_response(conn, f"AC {key}", addr)
 
     def account_deposit(self, conn, args, addr):
         """
@@ -172,15 +377,14 @@ class Commands:
                 self.send_response(conn, "ER Bank account number and amount format is incorrect.", addr)
                 return
 
-            with self.lock:
-                accounts = load_accounts()
+            with self.key_lock(key):
+                balance = self.store.get(key)
 
-                if key not in accounts:
+                if balance is None:
                     self.send_response(conn, "ER Account number format is incorrect.", addr)
                     return
 
-                accounts[key] += amount
-                save_accounts(accounts)
+                self.store.set(key, balance + amount)
 
             self.send_response(conn, "AD", addr)
 
@@ -206,28 +410,28 @@ class Commands:
                 self.send_response(conn, "ER Bank account number and amount format is incorrect.", addr)
                 return
 
-            with self.lock:
-                accounts = load_accounts()
+            with self.key_lock(key):
+                balance = self.store.get(key)
 
-                if key not in accounts:
+                if balance is None:
                     self.send_response(conn, "ER Account number format is incorrect.", addr)
                     return
 
-                if accounts[key] < amount:
+                if balance < amount:
                     self.send_response(conn, "ER Insufficient funds.", addr)
                     return
 
-                accounts[key] -= amount
-                save_accounts(accounts)
+                self.store.set(key, balance - amount)
 
             self.send_response(conn, "AW", addr)
 
     def account_balance(self, conn, args, addr):
         """
         Retrieves the balance of a specific account.
-        Forwards request if necessary.
+        Forwards request if necessary, balances of other banks are answered from
+        BALANCE_CACHE while fresh. "AB <key> FRESH" always asks the owning bank.
         """
-        if len(args) != 1:
+        if len(args) not in (1, 2) or (len(args) == 2 and args[1].upper() != "FRESH"):
             self.send_response(conn, "ER Account number format is incorrect.", addr)
             return
 
@@ -235,18 +439,17 @@ class Commands:
         target_ip = key.split('/')[1]
 
         if target_ip != self.get_my_ip():
-            res = self.forward_command(target_ip, f"AB {key}")
+            res = self.forward_balance(target_ip, key, fresh=len(args) == 2)
             self.send_response(conn, res, addr)
             return
 
-        with self.lock:
-            accounts = load_accounts()
+        balance = self.store.get(key)
 
-            if key not in accounts:
-                self.send_response(conn, "ER Account number format is incorrect.", addr)
-                return
+        if balance is None:
+            self.send_response(conn, "ER Account number format is incorrect.", addr)
+            return
 
-            self.send_response(conn, f"AB {accounts[key]}", addr)
+        self.send_response(conn, f"AB {balance}", addr)
 
     def account_remove(self, conn, args, addr):
         """
@@ -258,66 +461,349 @@ class Commands:
 
         key = args[0]
 
-        with self.lock:
-            accounts = load_accounts()
+        with self.key_lock(key):
+            balance = self.store.get(key)
 
-            if key not in accounts:
+            if balance is None:
                 self.send_response(conn, "ER Account number format is incorrect.", addr)
                 return
 
-            if accounts[key] != 0:
+            if balance != 0:
                 self.send_response(conn, "ER Cannot delete bank account containing funds.", addr)
                 return
 
-            del accounts[key]
-            save_accounts(accounts)
+            self.store.delete(key)
 
         self.send_response(conn, "AR", addr)
 
     def bank_total(self, conn, args, addr):
         """
-        Calculates and sends the total amount of money held in all accounts.
+        Sends the total amount of money held in all accounts.
+        The store keeps a running total, read at one consistent point of its journal
+        without taking any account locks. "BA VERIFY" recomputes it from all accounts
+        and reports any drift of the running total.
         """
-        with self.lock:
-            accounts = load_accounts()
-            self.send_response(conn, f"BA {sum(accounts.values())}", addr)
+        if args and args[0].upper() == "VERIFY":
+            tracked, actual, _, _ = self.store.verify()
+            if tracked != actual:
+                self.send_response(conn, f"ER Total drift detected: tracked {tracked}, actual {actual}.", addr)
+                return
+            self.send_response(conn, f"BA {actual}", addr)
+            return
+
+        self.send_response(conn, f"BA {self.store.total()}", addr)
 
     def bank_number(self, conn, args, addr):
         """
         Sends the total number of accounts managed by this bank.
+        "BN VERIFY" recomputes it from all accounts and reports any drift of the running count.
+        """
+        if args and args[0].upper() == "VERIFY":
+            _, _, tracked, actual = self.store.verify()
+            if tracked != actual:
+                self.send_response(conn, f"ER Count drift detected: tracked {tracked}, actual {actual}.", addr)
+                return
+            self.send_response(conn, f"BN {actual}", addr)
+            return
+
+        self.send_response(conn, f"BN {self.store.count()}", addr)
+
+    def batch(self, conn, args, addr):
+        """
+        Executes many account operations sent in one command.
+        Format: "BT ATOMIC|BEST AD <key> <amount>; AW <key> <amount>; AB <key>; AR <key>".
+        ATOMIC applies all operations or none, BEST applies every operation that succeeds.
+        Responds with "BT " followed by the per-item results separated by ";".
+        Items for other banks are grouped and forwarded as one batch per bank.
+        """
+        if len(args) < 2 or args[0].upper() not in ("ATOMIC", "BEST"):
+            self.send_response(conn, "ER Batch format is incorrect.", addr)
+            return
+
+        mode = args[0].upper()
+        items = []
+        for text in " ".join(args[1:]).split(";"):
+            parts = text.split()
+            if parts:
+                items.append(parts)
+
+        results = [None] * len(items)
+        local = []
+        remote = {}
+        my_ip = self.get_my_ip()
+
+        for i, parts in enumerate(items):
+            error = self._check_batch_item(parts)
+            if error:
+                results[i] = error
+                continue
+            target_ip = parts[1].split("/")[1]
+            if target_ip == my_ip:
+                local.append(i)
+            else:
+                remote.setdefault(target_ip, []).append(i)
+
+        if mode == "ATOMIC":
+            if any(results):
+                self.send_response(conn, self._batch_response(self._rolled_back(results)), addr)
+                return
+            if remote and (local or len(remote) > 1):
+                self.send_response(conn, "ER Atomic batch must target a single bank.", addr)
+                return
+            if remote:
+                target_ip = next(iter(remote))
+                res = self.forward_command(target_ip, f"BT ATOMIC {self._batch_text(items)}")
+                self.send_response(conn, res, addr)
+                return
+
+        for target_ip, indexes in remote.items():
+            group = [items[i] for i in indexes]
+            for i, result in zip(indexes, self._forward_batch(target_ip, group)):
+                results[i] = result
+
+        if local:
+            for i, result in zip(local, self._run_local_batch([items[i] for i in local], mode == "ATOMIC")):
+                results[i] = result
+
+        self.send_response(conn, self._batch_response(results), addr)
+
+    def _check_batch_item(self, parts):
+        """
+        Validates one batch item, returns an error message or None.
+        """
+        cmd = parts[0].upper()
+        if cmd in ("AD", "AW"):
+            if len(parts) != 3 or "/" not in parts[1]:
+                return "ER Bank account number and amount format is incorrect."
+            try:
+                int(parts[2])
+            except ValueError:
+                return "ER Bank account number and amount format is incorrect."
+        elif cmd in ("AB", "AR"):
+            if len(parts) != 2 or "/" not in parts[1]:
+                return "ER Account number format is incorrect."
+        else:
+            return "ER Unknown command"
+        return None
+
+    def _run_local_batch(self, items, atomic):
+        """
+        Applies local batch items in one pass while holding the locks of all their accounts.
+        All resulting balances are written as a single journal record.
+        """
+        keys = {parts[1] for parts in items}
+
+        with self.key_lock(*keys):
+            balances = {key: self.store.get(key) for key in keys}
+            results = []
+
+            for parts in items:
+                cmd, key = parts[0].upper(), parts[1]
+                balance = balances[key]
+
+                if balance is None:
+                    results.append("ER Account number format is incorrect.")
+                elif cmd == "AD":
+                    balances[key] = balance + int(parts[2])
+                    results.append("AD")
+                elif cmd == "AW":
+                    if balance < int(parts[2]):
+                        results.append("ER Insufficient funds.")
+                    else:
+                        balances[key] = balance - int(parts[2])
+                        results.append("AW")
+                elif cmd == "AB":
+                    results.append(f"AB {balance}")
+                elif balance != 0:
+                    results.append("ER Cannot delete bank account containing funds.")
+                else:
+                    balances[key] = None
+                    results.append("AR")
+
+            if atomic and any(r.startswith("ER") for r in results):
+                return self._rolled_back(results)
+
+            changes = []
+            for key, balance in balances.items():
+                if balance is None:
+                    if self.store.get(key) is not None:
+                        changes.append(["D", key])
+                elif balance != self.store.get(key):
+                    changes.append(["S", key, balance])
+
+            if changes:
+                self.store.apply(changes)
+
+        return results
+
+    def _forward_batch(self, target_ip, items):
+        """
+        Forwards a group of items to one bank as a single best-effort batch.
+        Falls back to forwarding the items one by one only if the bank does not know BT,
+        any other error is the answer for every item, as the bank may have applied them.
+        """
+        res = self.forward_command(target_ip, f"BT BEST {self._batch_text(items)}")
+
+        if res.startswith("BT "):
+            results = [r.strip() for r in res[3:].split(";")]
+            if len(results) == len(items):
+                return results
+            return ["ER Invalid batch response from bank."] * len(items)
+
+        if res == "ER Unknown command":
+            return [self.forward_command(target_ip, " ".join(parts)) for parts in items]
+
+        return [res] * len(items)
+
+    @staticmethod
+    def _rolled_back(results):
+        return [r if r and r.startswith("ER") else "ER Not applied, batch rolled back." for r in results]
+
+    @staticmethod
+    def _batch_text(items):
+        return "; ".join(" ".join(parts) for parts in items)
+
+    @staticmethod
+    def _batch_response(results):
+        return "BT " + "; ".join(results)
+
+    def stats(self, conn, args, addr):
+        """
+        Sends latency statistics of all handlers of this bank as one line of JSON.
+        Keys are "cmd.<code>.<OK|ER>", "peer.<ip|other>.<OK|ER>", "lock.wait" and "storage.io".
+        """
+        if not METRICS.enabled:
+            self.send_response(conn, "ER Metrics are disabled.", addr)
+            return
+
+        METRICS.flush(self.metrics_file, self.lock)
+        summary = {name: h.summary() for name, h in sorted(read_metrics(self.metrics_file).items())}
+        self.send_response(conn, "ST " + json.dumps(summary, separators=(",", ":")), addr)
+
+    def profile(self, conn, args, addr):
+        """
+        Controls profiling of the command path in all handlers of this bank.
+        Format: "PF START [seconds]", "PF STOP" or "PF REPORT". REPORT merges the
+        profiles written so far into one report and sends its path.
+        """
+        action = args[0].upper() if args else ""
+
+        if action == "START":
+            try:
+                window = float(args[1]) if len(args) > 1 else PROFILE_WINDOW
+            except ValueError:
+                self.send_response(conn, "ER Window must be a number of seconds.", addr)
+                return
+            if window <= 0:
+                self.send_response(conn, "ER Window must be a number of seconds.", addr)
+                return
+            PROFILER.start(window)
+            self.send_response(conn, f"PF ON {window:g}", addr)
+        elif action == "STOP":
+            PROFILER.stop()
+            self.send_response(conn, "PF OFF", addr)
+        elif action == "REPORT":
+            path = PROFILER.report()
+            if path is None:
+                self.send_response(conn, "ER No profile collected.", addr)
+                return
+            self.send_response(conn, f"PF {path}", addr)
+        else:
+            self.send_response(conn, "ER Use PF START [seconds], PF STOP or PF REPORT.", addr)
+
+    def load(self, conn, args, addr):
+        """
+        Sends the occupancy of the server's admission limits as one line of JSON:
+        active, waiting and rejected connections and forwarded requests, and the
+        connections rejected by the per-IP limit.
         """
-        with self.lock:
-            accounts = load_accounts()
-            self.send_response(conn, f"BN {len(accounts)}", addr)
+        if self.admission is None:
+            self.send_response(conn, "ER Admission control is not active.", addr)
+            return
+
+        self.send_response(conn, "LD " + json.dumps(self.admission.status(), separators=(",", ":")), addr)
+
+    def bank_refresh(self, conn, args, addr):
+        """
+        Resolves the bank's IP address again (e.g. after a network change) and sends it.
+        """
+        self.send_response(conn, f"BR {BANK_IDENTITY.refresh()}", addr)
 
     def get_my_ip(self):
         """
-        Retrieves the local machine's IP address.
+        Returns the bank's IP address.
+        The address is cached in BANK_IDENTITY or pinned via "bank_ip" in the config.
         """
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            s.connect(("8.8.8.8", 80))
-            return s.getsockname()[0]
-        except:
-            return "127.0.0.1"
-        finally:
-            s.close()
+        return BANK_IDENTITY.get()
+
+    def forward_balance(self, target_ip, key, fresh=False):
+        """
+        Forwards AB for an account of another bank through BALANCE_CACHE.
+        Hits and misses are recorded as "cache.AB.HIT" and "cache.AB.MISS".
+
+        Args:
+            target_ip (str): The owning bank.
+            key (str): The account.
+            fresh (bool): Skip the cached balance, the answer is still cached.
+        """
+        if not BALANCE_CACHE.enabled:
+            return self.forward_command(target_ip, f"AB {key}")
+
+        start = time.perf_counter()
+        if not fresh:
+            res = BALANCE_CACHE.get(key)
+            if res is not None:
+                METRICS.observe("cache.AB.HIT", time.perf_counter() - start)
+                return res
+
+        version = BALANCE_CACHE.version(key)
+        res = self.forward_command(target_ip, f"AB {key}")
+        if res.startswith("AB "):
+            BALANCE_CACHE.put(key, res, version)
+        if not fresh:
+            METRICS.observe("cache.AB.MISS", time.perf_counter() - start)
+        return res
 
     def forward_command(self, target_ip, command):
         """
         Attempts to forward a command to a target IP address.
-        Scans a range of ports starting from BASE_PORT defined in config.
-        Uses the P2P_TIMEOUT constant for socket operations.
+        With "forward_coalescing" enabled the command goes through FORWARDER and may
+        share one pipelined write with other commands for the same bank.
+        Cached balances of accounts changed by the command are invalidated.
+        Beyond the server's limit of forwarded requests in flight (and its queue)
+        the command is rejected without contacting the bank.
         """
-        for port in range(BASE_PORT, BASE_PORT + 11):
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(P2P_TIMEOUT)
-                    s.connect((target_ip, port))
-                    s.sendall((command + "\r\n").encode())
-                    response = s.recv(1024).decode().strip()
-                    return response
-            except (ConnectionRefusedError, socket.timeout):
-                continue
+        if self.admission is not None and not self.admission.forwards.enter():
+            return "ER Too many forwarded requests, try again later."
+
+        start = time.perf_counter()
+
+        try:
+            if FORWARDER is not None:
+                res = FORWARDER.submit(target_ip, command)
+            else:
+                res = forward_lines(target_ip, [command])[0]
+        finally:
+            if self.admission is not None:
+                self.admission.forwards.leave()
+
+        outcome = "ER" if res.startswith("ER") else "OK"
+        METRICS.observe(f"{peer_metric(target_ip)}.{outcome}", time.perf_counter() - start)
+
+        if BALANCE_CACHE.enabled:
+            self._invalidate_balances(command)
+        return res
 
-        return "ER Bank unreachable"
\ No newline at end of file
+    @staticmethod
+    def _invalidate_balances(command):
+        """
+        Drops the cached balances of the accounts a forwarded AD, AW, AR or BT changes.
+        """
+        parts = command.split()
+        if parts[0] == "BT":
+            items = [item.split() for item in " ".join(parts[2:]).split(";")]
+        else:
+            items = [parts]
+        for item in items:
+            if len(item) > 1 and item[0].upper() in ("AD", "AW", "AR"):
+                BALANCE_CACHE.invalidate(item[1])
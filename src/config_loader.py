@@ -4,20 +4,62 @@ import os
 DEFAULT_CONFIG = {
     "port": 65525,
     "client_timeout": 60,
-    "p2p_timeout": 1.0
+    "drain_timeout": 10,
+    "max_connections": 256,
+    "max_connections_per_ip": 32,
+    "max_forwards": 64,
+    "admission_queue_size": 64,
+    "admission_queue_timeout": 5.0,
+    "p2p_timeout": 1.0,
+    "compact_every": 1000,
+    "storage": "journal",
+    "durability": "none",
+    "group_commit_window": 0.001,
+    "group_commit_max_batch": 64,
+    "server_mode": "process",
+    "async_threads": 32,
+    "workers": 0,
+    "peer_pool_size": 4,
+    "peer_idle_timeout": 30,
+    "peer_port_ttl": 300,
+    "peer_dead_ttl": 10,
+    "bank_ip": "",
+    "ip_check_interval": 30,
+    "log_dir": "",
+    "log_flush_interval": 0.2,
+    "log_batch_size": 500,
+    "log_queue_size": 10000,
+    "log_queue_policy": "block",
+    "log_max_bytes": 10485760,
+    "log_backups": 5,
+    "lock_stripes": 64,
+    "forward_coalescing": False,
+    "forward_window": 0.002,
+    "forward_max_batch": 64,
+    "forward_timeout": 5.0,
+    "binary_forwarding": True,
+    "balance_cache_ttl": 0,
+    "balance_cache_size": 10000,
+    "peer_base_port": 0,
+    "metrics": True,
+    "metrics_dump_interval": 10,
+    "profiling": False,
+    "profile_window": 60,
+    "slow_command_ms": 500
 }
 
 
 def load_config():
     """
-    Loads configuration settings from a JSON file located in the '../config' directory.
+    Loads configuration settings from a JSON file located in the '../config' directory,
+    or from the file named by the P2P_CONFIG environment variable.
     If the file does not exist or is invalid, returns default values.
 
     Returns:
         dict: A dictionary containing configuration parameters (port, client_timeout, p2p_timeout).
     """
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    config_path = os.path.join(base_dir, "config", "config.json")
+    config_path = os.environ.get("P2P_CONFIG") or os.path.join(base_dir, "config", "config.json")
 
     if not os.path.exists(config_path):
         return DEFAULT_CONFIG
@@ -0,0 +1,129 @@
+import errno
+import select
+import socket
+import threading
+import time
+
+CONNECT_PENDING = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035)
+
+
+class PortDiscovery:
+    """
+    Remembers on which port each peer bank answers.
+    On a cache miss all candidate ports are probed at once. A peer that answered on
+    no port is cached as dead for a short time, so repeated requests fail fast.
+    """
+
+    def __init__(self, ports, ttl=300.0, dead_ttl=10.0, timeout=1.0):
+        """
+        Args:
+            ports (range): Candidate ports of peer banks.
+            ttl (float): Seconds a discovered port is trusted.
+            dead_ttl (float): Seconds an unreachable peer is not probed again.
+            timeout (float): Connect timeout of one probe round.
+        """
+        self.ports = list(ports)
+        self.ttl = ttl
+        self.dead_ttl = dead_ttl
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.known = {}
+        self.dead = {}
+
+    def lookup(self, ip):
+        """
+        Returns the cached port of a peer, or None if it is unknown or expired.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.known.get(ip)
+            if entry is None:
+                return None
+            if entry[1] < now:
+                del self.known[ip]
+                return None
+            return entry[0]
+
+    def is_dead(self, ip):
+        """
+        Returns True if the peer was recently found unreachable.
+        """
+        now = time.monotonic()
+        with self.lock:
+            until = self.dead.get(ip)
+            if until is None:
+                return False
+            if until < now:
+                del self.dead[ip]
+                return False
+            return True
+
+    def remember(self, ip, port):
+        with self.lock:
+            self.known[ip] = (port, time.monotonic() + self.ttl)
+            self.dead.pop(ip, None)
+
+    def invalidate(self, ip):
+        with self.lock:
+            self.known.pop(ip, None)
+
+    def mark_dead(self, ip):
+        with self.lock:
+            self.known.pop(ip, None)
+            self.dead[ip] = time.monotonic() + self.dead_ttl
+
+    def probe(self, ip):
+        """
+        Connects to all candidate ports concurrently and keeps the first that accepts.
+        The result is cached, an unsuccessful probe marks the peer as dead.
+
+        Returns:
+            tuple: (port, connected socket) or None if no port accepted.
+        """
+        pending = {}
+        for port in self.ports:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setblocking(False)
+            try:
+                err = s.connect_ex((ip, port))
+            except OSError:
+                err = -1
+            if err in CONNECT_PENDING:
+                pending[s] = port
+            else:
+                s.close()
+
+        found = None
+        deadline = time.monotonic() + self.timeout
+
+        try:
+            while pending and found is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                candidates = list(pending)
+                _, writable, failed = select.select([], candidates, candidates, remaining)
+
+                for s in failed:
+                    if s in pending:
+                        del pending[s]
+                        s.close()
+
+                for s in writable:
+                    if s not in pending:
+                        continue
+                    port = pending.pop(s)
+                    if found is None and s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                        s.setblocking(True)
+                        found = (port, s)
+                    else:
+                        s.close()
+        finally:
+            for s in pending:
+                s.close()
+
+        if found is None:
+            self.mark_dead(ip)
+        else:
+            self.remember(ip, found[0])
+        return found
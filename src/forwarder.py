@@ -0,0 +1,97 @@
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+
+IDLE_EXIT = 30.0
+
+
+class Forwarder:
+    """
+    Outbound stage that coalesces forwarded commands per target bank.
+
+    Requests for one bank are queued. A sender thread per bank waits a short window
+    for more requests and writes them pipelined over one connection, then hands
+    every response back to the waiting caller. Callers wait at most `timeout`
+    seconds for their own response.
+    """
+
+    def __init__(self, send, window=0.002, max_batch=64, timeout=5.0):
+        """
+        Args:
+            send (callable): send(ip, commands) -> list of response lines, one per command.
+            window (float): Seconds to wait for more requests before sending a batch.
+            max_batch (int): Maximum number of commands sent in one write.
+            timeout (float): Seconds a caller waits for its response.
+        """
+        self.send = send
+        self.window = window
+        self.max_batch = max(1, int(max_batch))
+        self.timeout = timeout
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.queues = {}
+
+    def submit(self, ip, command):
+        """
+        Queues a command for a bank and waits for its response.
+
+        Returns:
+            str: The response line, or "ER Bank unreachable" on timeout.
+        """
+        if self.pid != os.getpid():
+            self._reset()
+
+        future = concurrent.futures.Future()
+
+        with self.lock:
+            q = self.queues.get(ip)
+            if q is None:
+                q = queue.Queue()
+                self.queues[ip] = q
+                threading.Thread(target=self._run, args=(ip, q), name=f"forward-{ip}", daemon=True).start()
+            q.put((command, future))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return "ER Bank unreachable"
+
+    def _run(self, ip, q):
+        while True:
+            try:
+                first = q.get(timeout=IDLE_EXIT)
+            except queue.Empty:
+                with self.lock:
+                    if q.empty():
+                        del self.queues[ip]
+                        return
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            batch = [(command, future) for command, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                responses = self.send(ip, [command for command, _ in batch])
+            except Exception:
+                responses = ["ER Bank unreachable"] * len(batch)
+
+            for (_, future), response in zip(batch, responses):
+                future.set_result(response)
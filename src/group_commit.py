@@ -0,0 +1,72 @@
+import threading
+import time
+
+
+class GroupCommit:
+    """
+    Makes writes durable with one fsync for many concurrent writers.
+
+    A writer calls wait() after its write. The first waiting writer becomes the
+    leader. If it is alone it syncs at once, so a single writer never pays the window.
+    If other writers are already waiting (writes are concurrent), it waits up to the
+    commit window for more of them (or until max_batch writers are waiting). Then it
+    runs one sync that covers all of their writes and wakes them up. Writers arriving
+    during the sync form the next group.
+    """
+
+    def __init__(self, window=0.001, max_batch=64, metrics=None):
+        """
+        Args:
+            window (float): Seconds the leader waits for more writers, 0 syncs at once.
+            max_batch (int): Number of waiting writers that ends the window early.
+            metrics (Metrics, optional): Receives the sync time as "storage.fsync".
+        """
+        self.window = window
+        self.max_batch = max(1, int(max_batch))
+        self.metrics = metrics
+        self.cond = threading.Condition()
+        self.written = 0
+        self.durable = 0
+        self.syncing = False
+
+    def wait(self, sync):
+        """
+        Blocks until a sync started after this call has completed.
+
+        Args:
+            sync (callable): Flushes everything written so far to disk, e.g. an fsync.
+
+        Raises:
+            OSError: If the sync covering this write failed.
+        """
+        with self.cond:
+            self.written += 1
+            ticket = self.written
+            self.cond.notify_all()
+
+            while self.durable < ticket:
+                if self.syncing:
+                    self.cond.wait()
+                    continue
+
+                self.syncing = True
+                deadline = time.monotonic() + self.window
+                while 1 < self.written - self.durable < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                target = self.written
+
+                self.cond.release()
+                start = time.perf_counter()
+                try:
+                    sync()
+                finally:
+                    if self.metrics is not None:
+                        self.metrics.observe("storage.fsync", time.perf_counter() - start)
+                    self.cond.acquire()
+                    self.syncing = False
+                    self.cond.notify_all()
+
+                self.durable = max(self.durable, target)
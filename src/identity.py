@@ -0,0 +1,60 @@
+import os
+import socket
+import time
+
+BANK_IP_ENV = "P2P_BANK_IP"
+
+
+def resolve_local_ip():
+    """
+    Retrieves the local machine's IP address from the default route.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("8.8.8.8", 80))
+        return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+    finally:
+        s.close()
+
+
+class BankIdentity:
+    """
+    Holds the bank code (IP address) of this node.
+    The address is resolved once and stored in the environment, so processes started
+    later (connection handlers, workers, the UI) inherit it instead of resolving again.
+    It is re-resolved only on refresh() or when the periodic interface check runs.
+    """
+
+    def __init__(self, pinned="", check_interval=30.0):
+        """
+        Args:
+            pinned (str): Fixed bank IP from the config, empty to detect it.
+            check_interval (float): Seconds between interface change checks, 0 disables them.
+        """
+        self.pinned = pinned
+        self.check_interval = check_interval
+        self.ip = pinned or os.environ.get(BANK_IP_ENV)
+        self.next_check = time.monotonic() + check_interval
+
+    def get(self):
+        """
+        Returns the bank IP, resolving it only if it is unknown or the check interval passed.
+        """
+        if self.pinned:
+            return self.pinned
+        if self.ip is None or (self.check_interval and time.monotonic() >= self.next_check):
+            return self.refresh()
+        return self.ip
+
+    def refresh(self):
+        """
+        Resolves the bank IP again and publishes it to child processes.
+        """
+        if self.pinned:
+            return self.pinned
+        self.ip = resolve_local_ip()
+        os.environ[BANK_IP_ENV] = self.ip
+        self.next_check = time.monotonic() + self.check_interval
+        return self.ip
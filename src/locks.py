@@ -0,0 +1,61 @@
+import contextlib
+import multiprocessing
+import zlib
+
+
+class StripedLock:
+    """
+    Shared re-entrant lock plus a fixed set of stripe locks for single accounts.
+
+    Used as a context manager it behaves like the plain shared lock. for_key()
+    returns the stripe guarding one account, so operations on different accounts
+    do not wait for each other. Stripes are chosen with CRC32 of the key, which is
+    stable across processes, so every process maps a key to the same stripe.
+    """
+
+    def __init__(self, stripes=16, lock=None):
+        """
+        Args:
+            stripes (int): Number of stripe locks. With 0 every key maps to the shared lock.
+            lock (multiprocessing.RLock, optional): Existing shared lock to wrap.
+        """
+        self.lock = lock if lock is not None else multiprocessing.RLock()
+        self.stripes = [multiprocessing.RLock() for _ in range(stripes)]
+
+    def for_key(self, key):
+        """
+        Returns the lock guarding the given account key.
+        """
+        if not self.stripes:
+            return self.lock
+        return self.stripes[zlib.crc32(key.encode()) % len(self.stripes)]
+
+    @contextlib.contextmanager
+    def for_keys(self, keys):
+        """
+        Holds the locks of several accounts at once.
+        Stripes are always taken in the same order, so two batches cannot deadlock.
+        """
+        if not self.stripes:
+            locks = [self.lock]
+        else:
+            indexes = sorted({zlib.crc32(key.encode()) % len(self.stripes) for key in keys})
+            locks = [self.stripes[i] for i in indexes]
+
+        with contextlib.ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            yield
+
+    def acquire(self, *args, **kwargs):
+        return self.lock.acquire(*args, **kwargs)
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.lock.release()
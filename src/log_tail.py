@@ -0,0 +1,163 @@
+import os
+
+# Every INDEX_EVERY-th line start is kept in the index, so paging seeks close to any line.
+INDEX_EVERY = 100
+# Bytes read per poll, larger files are caught up over several polls.
+MAX_READ = 4 * 1024 * 1024
+
+
+class LogTail:
+    """
+    Follows a growing log file without reading it again.
+
+    Keeps the byte offset after the last complete line, so every poll reads only the
+    bytes appended since. While reading, the byte offset of every INDEX_EVERY-th line
+    is recorded, so any older page of lines is read with one seek. The file is opened
+    only for the duration of a poll or page, so the writer can rotate it (also on
+    Windows, where an open file cannot be renamed). A rotated (replaced) or truncated
+    file is detected by its identity and size, the rest of the old file is read from
+    its rotated name and the new file is followed from its start.
+    """
+
+    def __init__(self, path, window=1000, rotated=None):
+        """
+        Args:
+            path (str): Log file to follow.
+            window (int): Maximum number of lines returned by one poll or page.
+            rotated (str, optional): Name the writer renames a full file to, defaults to "<path>.1".
+        """
+        self.path = path
+        self.rotated = rotated or f"{path}.1"
+        self.window = max(1, int(window))
+        self.identity = None
+        self.offset = 0
+        self.lines = 0
+        self.index = []
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def poll(self):
+        """
+        Reads the lines appended since the last poll.
+
+        Returns:
+            tuple: (lines, replace, more). lines are at most the newest `window` new lines,
+                replace is True if more lines were appended than fit the window (the
+                previous lines should be dropped), more is True if the file has more
+                unread data.
+
+        Raises:
+            OSError: If the file cannot be read.
+        """
+        lines = []
+        replace = False
+        current = _stat(self.path)
+
+        if self.identity is not None and (
+                current is None or _identity(current) != self.identity or current.st_size < self.offset):
+            old = _stat(self.rotated)
+            if old is not None and _identity(old) == self.identity:
+                lines, replace, _ = self._read(self.rotated, None)
+            self.identity = None
+
+        if current is None:
+            return lines, replace, False
+        if self.identity is None:
+            self.identity = _identity(current)
+            self.offset = 0
+            self.lines = 0
+            self.index = []
+
+        new_lines, new_replace, more = self._read(self.path, MAX_READ)
+        if new_replace:
+            return new_lines, True, more
+        lines = (lines + new_lines)[-self.window:]
+        return lines, replace, more
+
+    def read_lines(self, first, count=None):
+        """
+        Reads complete lines of the current file by line number.
+
+        Args:
+            first (int): Number of the first line, 0 is the first line of the file.
+            count (int, optional): Number of lines, defaults to the window.
+
+        Returns:
+            list: The lines, without line endings. Empty if the file was rotated since the last poll.
+        """
+        if self.identity is None or first >= self.lines:
+            return []
+        first = max(0, first)
+        count = min(count or self.window, self.lines - first)
+
+        try:
+            with open(self.path, "rb") as f:
+                if _identity(os.fstat(f.fileno())) != self.identity:
+                    return []
+                f.seek(self.index[first // INDEX_EVERY])
+                for _ in range(first % INDEX_EVERY):
+                    f.readline()
+                return [self._decode(f.readline()) for _ in range(count)]
+        except FileNotFoundError:
+            return []
+
+    def close(self):
+        """
+        Forgets the followed file, the next poll starts from its beginning.
+        """
+        self.identity = None
+
+    def _read(self, path, limit):
+        """
+        Reads up to `limit` bytes of complete lines after the offset and indexes them.
+        Reads nothing (and reports more data) if the file at `path` is no longer the followed one.
+        """
+        try:
+            with open(path, "rb") as f:
+                if _identity(os.fstat(f.fileno())) != self.identity:
+                    return [], False, True
+                f.seek(self.offset)
+                data = f.read() if limit is None else f.read(limit)
+        except FileNotFoundError:
+            return [], False, True
+        more = limit is not None and len(data) == limit
+
+        end = data.rfind(b"\n") + 1
+        if not end:
+            if not more:
+                return [], False, False
+            # A line longer than the read limit is split.
+            end = len(data)
+        data = data[:end]
+
+        start = 0
+        while start < end:
+            if self.lines % INDEX_EVERY == 0:
+                self.index.append(self.offset + start)
+            start = data.find(b"\n", start) + 1 or end
+            self.lines += 1
+        self.offset += end
+
+        cut = end - 1
+        for _ in range(self.window):
+            cut = data.rfind(b"\n", 0, cut)
+            if cut < 0:
+                break
+        lines = [self._decode(line) for line in data[cut + 1:].splitlines()]
+        return lines, cut >= 0, more
+
+    @staticmethod
+    def _decode(line):
+        return line.decode("utf-8", errors="replace").rstrip("\r\n")
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _identity(st):
+    return st.st_dev, st.st_ino
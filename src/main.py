@@ -1,80 +1,272 @@
 import socket
+import collections
 import multiprocessing
+import multiprocessing.connection
+import signal
 import subprocess
 import sys
 import time
 import os
-from command import Commands
+from command import Commands, BANK_IDENTITY, PROFILER, PROFILE_WINDOW
+from locks import StripedLock
 from config_loader import load_config
+from protocol import Session, LineTooLongError, RECV_SIZE
+from admission import Admission, BUSY
 
 CONFIG = load_config()
 PORT = CONFIG["port"]
 CLIENT_TIMEOUT = CONFIG["client_timeout"]
+SERVER_MODE = CONFIG["server_mode"]
+LOCK_STRIPES = CONFIG["lock_stripes"]
+DRAIN_TIMEOUT = CONFIG["drain_timeout"]
 
 
-def handle_client(conn, addr, lock):
+class ServerStopped(Exception):
+    """
+    Raised in the accepting process when it receives SIGTERM.
+    """
+
+
+def handle_client(conn, addr, lock, admission=None):
     """
     Handles a single client connection.
+    Incoming data is split into CRLF terminated commands, so clients may pipeline
+    several commands per packet or split one command across packets. All commands
+    completed by one read are answered with a single send. A client that negotiates
+    the binary protocol ("BP 1") continues with binary frames.
     If the connection times out due to inactivity, sends a notification message
     to the client before closing the connection.
 
     Args:
         conn (socket.socket): Client connection socket.
         addr (tuple): Client address info (IP, Port).
-        lock (multiprocessing.RLock): Shared re-entrant lock.
+        lock (StripedLock): Shared re-entrant lock with per-account stripes.
+        admission (Admission, optional): Limits of the server.
     """
-    commands = Commands(lock)
+    commands = Commands(lock, admission)
     client_ip = addr[0]
+    session = Session()
 
     conn.settimeout(CLIENT_TIMEOUT)
 
     with conn:
-        while True:
-            try:
-                data = conn.recv(1024)
-                if not data:
-                    break
-                commands.execute(data.decode().strip(), conn, addr=client_ip)
-            except socket.timeout:
+        try:
+            while True:
                 try:
-                    msg = "TIMEOUT: Connection closed due to inactivity.\r\n"
-                    conn.sendall(msg.encode())
-                except OSError:
-                    pass
-                break
-            except ConnectionResetError:
-                break
+                    data = conn.recv(RECV_SIZE)
+                    if not data:
+                        break
+                    with PROFILER.profile():
+                        response = session.process(commands, data, client_ip)
+                    if response:
+                        conn.sendall(response)
+                except LineTooLongError as e:
+                    try:
+                        conn.sendall(f"{e}\r\n".encode())
+                    except OSError:
+                        pass
+                    break
+                except socket.timeout:
+                    try:
+                        msg = "TIMEOUT: Connection closed due to inactivity.\r\n"
+                        conn.sendall(msg.encode())
+                    except OSError:
+                        pass
+                    break
+                except ConnectionResetError:
+                    break
+        finally:
+            commands.close()
+
+
+def client_process(conn, addr, lock, admission):
+    """
+    Entry point of a connection process in "process" mode.
+    SIGTERM stops reading from the client, commands already received are still
+    executed and answered before the connection is closed.
+    """
+    def drain(signum, frame):
+        try:
+            conn.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+
+    signal.signal(signal.SIGTERM, drain)
+    handle_client(conn, addr, lock, admission)
+
+
+def reject(conn):
+    """
+    Answers a connection that is not admitted with the busy response and closes it.
+    """
+    try:
+        conn.settimeout(1.0)
+        conn.sendall(f"{BUSY}\r\n".encode())
+    except OSError:
+        pass
+    conn.close()
 
 
-def run_server_process():
+def stop_clients(clients):
+    """
+    Asks the connection processes to finish and waits up to DRAIN_TIMEOUT seconds,
+    processes still running after that are killed.
+
+    Args:
+        clients (iterable): The connection processes.
+    """
+    for p in clients:
+        if p.is_alive():
+            p.terminate()
+
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    for p in clients:
+        p.join(max(0.0, deadline - time.monotonic()))
+        if p.is_alive():
+            p.kill()
+            p.join()
+
+
+def accept_clients(s, lock, admission):
+    """
+    Accept loop of "process" mode, every admitted connection gets its own process.
+    Over the connection limit a connection waits in the admission queue until a
+    connection process ends, for at most "admission_queue_timeout" seconds. Over
+    the queue or the per-IP limit it is answered with the busy response at once.
+    Returns (after stopping the connection processes) when the listener fails or
+    SIGTERM is received.
+
+    Args:
+        s (socket.socket): Listening socket.
+        lock (StripedLock): Shared re-entrant lock with per-account stripes.
+        admission (Admission): Limits of the server.
+    """
+    gate = admission.connections
+    clients = {}
+    pending = collections.deque()
+    per_ip = collections.Counter()
+
+    def start(conn, addr):
+        p = multiprocessing.Process(
+            target=client_process,
+            args=(conn, addr, lock, admission),
+            daemon=True
+        )
+        p.start()
+        conn.close()
+        clients[p.sentinel] = (p, addr[0])
+
+    def release(ip):
+        per_ip[ip] -= 1
+        if not per_ip[ip]:
+            del per_ip[ip]
+
+    try:
+        while True:
+            timeout = max(0.0, pending[0][2] - time.monotonic()) if pending else None
+
+            for ready in multiprocessing.connection.wait([s, *clients], timeout):
+                if ready is s:
+                    conn, addr = s.accept()
+                    if not admission.ip_allowed(per_ip[addr[0]]):
+                        reject(conn)
+                    elif gate.try_enter():
+                        per_ip[addr[0]] += 1
+                        start(conn, addr)
+                    elif gate.join_queue():
+                        per_ip[addr[0]] += 1
+                        pending.append((conn, addr, time.monotonic() + gate.timeout))
+                    else:
+                        reject(conn)
+                else:
+                    p, ip = clients.pop(ready)
+                    p.join()
+                    release(ip)
+                    gate.leave()
+
+            while pending and pending[0][2] <= time.monotonic():
+                conn, addr, _ = pending.popleft()
+                gate.leave_queue(rejected=True)
+                release(addr[0])
+                reject(conn)
+
+            while pending and gate.try_enter(queued=True):
+                conn, addr, _ = pending.popleft()
+                gate.leave_queue()
+                start(conn, addr)
+    finally:
+        for conn, _, _ in pending:
+            gate.leave_queue()
+            reject(conn)
+        stop_clients([p for p, _ in clients.values()])
+
+
+def run_server_process(ready=None):
     """
     Initializes and runs the TCP server.
-    Spawns a new process for each incoming connection.
+    In "process" mode spawns a new process for each incoming connection,
+    in "async" mode serves all clients from one event loop,
+    in "prefork" mode runs a supervised pool of event-loop workers.
+    In every mode SIGTERM stops accepting connections and lets the commands in
+    flight finish (for at most "drain_timeout" seconds) before the server returns.
+
+    Args:
+        ready (callable, optional): Called with the bound host and port as soon as
+            clients can connect.
     """
-    lock = multiprocessing.RLock()
+    lock = StripedLock(LOCK_STRIPES)
+    admission = Admission.from_config(CONFIG)
     commands = Commands(lock)
+    commands.reset_metrics()
     host = commands.get_my_ip()
 
+    if CONFIG["profiling"]:
+        PROFILER.start(PROFILE_WINDOW)
+
+    if SERVER_MODE == "async":
+        from async_server import run_async_server
+        try:
+            run_async_server(lock, host, PORT, ready=ready, admission=admission)
+        except OSError:
+            pass
+        return
+
+    if SERVER_MODE == "prefork":
+        from worker_pool import run_worker_pool
+        try:
+            run_worker_pool(lock, host, PORT, ready=ready, admission=admission)
+        except OSError:
+            pass
+        return
+
+    server_pid = os.getpid()
+
+    def stop(signum, frame):
+        if os.getpid() != server_pid:
+            # A connection process that has not installed its own handler yet.
+            sys.exit(0)
+        # A second SIGTERM while draining terminates at once.
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        raise ServerStopped()
+
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             s.bind((host, PORT))
             s.listen()
+            signal.signal(signal.SIGTERM, stop)
 
-            while True:
-                conn, addr = s.accept()
-                p = multiprocessing.Process(
-                    target=handle_client,
-                    args=(conn, addr, lock),
-                    daemon=True
-                )
-                p.start()
-    except OSError:
+            if ready is not None:
+                ready(*s.getsockname()[:2])
+
+            accept_clients(s, lock, admission)
+    except (OSError, ServerStopped):
         pass
 
 
 if __name__ == "__main__":
     multiprocessing.freeze_support()
+    BANK_IDENTITY.get()
 
     server_process = multiprocessing.Process(target=run_server_process, daemon=False)
     server_process.start()
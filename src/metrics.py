@@ -0,0 +1,191 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the latency buckets in seconds, the last bucket is unbounded.
+BUCKETS = [
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+]
+
+
+class Histogram:
+    """
+    Latency histogram with fixed logarithmic buckets.
+    Recording a value is a binary search and two additions.
+    """
+
+    def __init__(self, counts=None, total=0.0):
+        self.counts = list(counts) if counts else [0] * (len(BUCKETS) + 1)
+        self.total = total
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound (in seconds) of the bucket containing the given percentile.
+        """
+        n = self.count()
+        if not n:
+            return 0.0
+        rank = fraction * n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return float("inf")
+
+    def to_dict(self):
+        return {"counts": self.counts, "total": self.total}
+
+    def summary(self):
+        n = self.count()
+        return {
+            "count": n,
+            "avg_ms": round(self.total / n * 1000, 3) if n else 0.0,
+            "p50_ms": self.percentile(0.50) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+        }
+
+
+class Metrics:
+    """
+    Per-process counters and latency histograms.
+
+    Every process collects its own values and periodically merges them into a shared
+    JSON file under the shared lock, so the file holds the totals of all connection
+    handlers and workers. When disabled, recording does nothing.
+    """
+
+    def __init__(self, enabled=True, dump_interval=10.0):
+        """
+        Args:
+            enabled (bool): Record values at all.
+            dump_interval (float): Seconds between merges into the shared file, 0 merges
+                only on request and when a handler closes.
+        """
+        self.enabled = enabled
+        self.dump_interval = dump_interval
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.histograms = {}
+        self.next_dump = time.monotonic() + self.dump_interval
+
+    def observe(self, name, seconds):
+        """
+        Records one event and its duration under the given name.
+        """
+        spans = getattr(self.local, "spans", None)
+        if spans is not None:
+            spans[name] = spans.get(name, 0.0) + seconds
+        if not self.enabled:
+            return
+        if self.pid != os.getpid():
+            self._reset()
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def begin_trace(self):
+        """
+        Starts summing the durations observed by the current thread, even when disabled.
+        """
+        if self.pid != os.getpid():
+            self._reset()
+        self.local.spans = {}
+
+    def end_trace(self):
+        """
+        Stops the trace of the current thread.
+
+        Returns:
+            dict: Name -> seconds observed since begin_trace().
+        """
+        spans = getattr(self.local, "spans", None)
+        self.local.spans = None
+        return spans or {}
+
+    def maybe_flush(self, path, lock):
+        """
+        Merges into the shared file if the dump interval has passed.
+        """
+        if self.enabled and self.dump_interval and time.monotonic() >= self.next_dump:
+            self.flush(path, lock)
+
+    def flush(self, path, lock):
+        """
+        Merges the values recorded since the last flush into the shared file.
+
+        Args:
+            path (str): Shared metrics file.
+            lock (multiprocessing.RLock): Lock shared by all processes writing the file.
+        """
+        if not self.enabled:
+            return
+        if self.pid != os.getpid():
+            self._reset()
+
+        with self.lock:
+            pending = self.histograms
+            self.histograms = {}
+            self.next_dump = time.monotonic() + self.dump_interval
+
+        if not pending:
+            return
+
+        with lock:
+            merged = read_metrics(path)
+            for name, histogram in pending.items():
+                merged.setdefault(name, Histogram()).merge(histogram)
+
+            tmp = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump({name: h.to_dict() for name, h in merged.items()}, f)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+
+
+def read_metrics(path):
+    """
+    Loads the shared metrics file.
+
+    Returns:
+        dict: Name -> Histogram.
+    """
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {name: Histogram(h["counts"], h["total"]) for name, h in data.items()}
+
+
+def reset_metrics(path):
+    """
+    Removes the shared metrics file, so statistics start empty with a new server run.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,255 @@
+import os
+import select
+import socket
+import threading
+import time
+from protocol import LineBuffer, RECV_SIZE
+from binary_protocol import NEGOTIATE, encode_request, decode_response, next_frame
+
+
+class PeerBusyError(Exception):
+    """
+    Raised when all connections to a peer are in use for longer than the timeout.
+    """
+
+
+class PeerConnection:
+    """
+    A keep-alive connection to another bank.
+    Speaks the text protocol, or binary frames after a successful negotiate().
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lines = LineBuffer()
+        self.binary = False
+        self.last_used = time.monotonic()
+
+    def negotiate(self):
+        """
+        Asks the peer to switch to the binary protocol.
+        A peer that does not support it answers with an error and the connection stays in text mode.
+        """
+        self.binary = self._request_text([NEGOTIATE]) == [NEGOTIATE]
+
+    def request(self, commands):
+        """
+        Sends commands in one write (pipelined) and waits for one response line per command.
+
+        Raises:
+            ConnectionResetError: If the peer closed the connection.
+        """
+        if self.binary:
+            responses = self._request_binary(commands)
+        else:
+            responses = self._request_text(commands)
+        self.last_used = time.monotonic()
+        return responses
+
+    def _request_text(self, commands):
+        self.sock.sendall("".join(command + "\r\n" for command in commands).encode())
+        responses = []
+        while len(responses) < len(commands):
+            responses.extend(self.lines.feed(self._recv()))
+        return responses[:len(commands)]
+
+    def _request_binary(self, commands):
+        self.sock.sendall(b"".join(encode_request(command) for command in commands))
+        buffer = self.lines.buffer
+        responses = []
+        while len(responses) < len(commands):
+            payload = next_frame(buffer)
+            if payload is None:
+                buffer += self._recv()
+            else:
+                responses.append(decode_response(payload))
+        return responses
+
+    def _recv(self):
+        data = self.sock.recv(RECV_SIZE)
+        if not data:
+            raise ConnectionResetError("Peer closed the connection")
+        return data
+
+    def is_healthy(self):
+        """
+        Checks that an idle connection can be reused.
+        An idle connection must not be readable: readable means the peer
+        closed it or sent something unsolicited (e.g. its TIMEOUT notice).
+        """
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class PeerPool:
+    """
+    Pool of keep-alive connections to other banks, keyed by (ip, port).
+    Limits the number of open connections per peer, drops connections that stayed
+    idle too long and checks idle connections before reusing them.
+    Thread-safe; after a fork the child starts with an empty pool.
+    """
+
+    def __init__(self, max_per_peer=4, idle_timeout=30.0, timeout=1.0, binary=False):
+        """
+        Args:
+            max_per_peer (int): Maximum number of open connections to one peer.
+            idle_timeout (float): Seconds after which an unused connection is closed.
+            timeout (float): Connect, read and slot wait timeout in seconds.
+            binary (bool): Negotiate the binary protocol on new connections.
+        """
+        self.max_per_peer = max(1, int(max_per_peer))
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.binary = binary
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.slots = {}
+
+    def _check_fork(self):
+        if self.pid != os.getpid():
+            self._reset()
+
+    def request(self, ip, port, command):
+        """
+        Sends a command to a peer over a pooled connection and returns the response line.
+        """
+        return self.request_many(ip, port, [command])[0]
+
+    def request_many(self, ip, port, commands):
+        """
+        Sends several commands to a peer over one pooled connection, pipelined in a
+        single write, and returns their response lines in order.
+        A reused connection that the peer has closed is replaced by a fresh one once.
+        Timeouts are not retried, the peer may already have applied the command.
+
+        Raises:
+            PeerBusyError: If no connection slot is freed within the timeout.
+            ConnectionRefusedError, socket.timeout: If the peer cannot be reached.
+            OSError: If the connection fails otherwise, e.g. it is reset.
+        """
+        self._check_fork()
+        peer = (ip, port)
+        slot = self._slot(peer)
+
+        if not slot.acquire(timeout=self.timeout):
+            raise PeerBusyError(f"All connections to {ip}:{port} are busy")
+
+        try:
+            conn = self._take_idle(peer)
+            if conn is not None:
+                try:
+                    return self._send(peer, conn, commands)
+                except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError):
+                    pass
+
+            return self._send(peer, self._connect(peer), commands)
+        finally:
+            slot.release()
+
+    def adopt(self, ip, port, sock):
+        """
+        Adds an already connected socket (e.g. from port discovery) to the idle pool.
+        """
+        self._check_fork()
+        sock.settimeout(self.timeout)
+        conn = PeerConnection(sock)
+        if self.binary:
+            try:
+                conn.negotiate()
+            except OSError:
+                conn.close()
+                return
+        with self.lock:
+            conns = self.idle.setdefault((ip, port), [])
+            if len(conns) < self.max_per_peer:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def evict_idle(self):
+        """
+        Closes connections that stayed idle longer than idle_timeout.
+        """
+        self._check_fork()
+        deadline = time.monotonic() - self.idle_timeout
+        with self.lock:
+            for peer, conns in self.idle.items():
+                keep = []
+                for conn in conns:
+                    if conn.last_used < deadline:
+                        conn.close()
+                    else:
+                        keep.append(conn)
+                self.idle[peer] = keep
+
+    def close(self):
+        """
+        Closes all idle connections.
+        """
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+    def _send(self, peer, conn, commands):
+        try:
+            response = conn.request(commands)
+        except BaseException:
+            conn.close()
+            raise
+        self._put_idle(peer, conn)
+        return response
+
+    def _slot(self, peer):
+        with self.lock:
+            slot = self.slots.get(peer)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_per_peer)
+                self.slots[peer] = slot
+            return slot
+
+    def _take_idle(self, peer):
+        self.evict_idle()
+        with self.lock:
+            conns = self.idle.get(peer)
+            while conns:
+                conn = conns.pop()
+                if conn.is_healthy():
+                    return conn
+                conn.close()
+        return None
+
+    def _put_idle(self, peer, conn):
+        with self.lock:
+            self.idle.setdefault(peer, []).append(conn)
+
+    def _connect(self, peer):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.settimeout(self.timeout)
+        try:
+            s.connect(peer)
+        except BaseException:
+            s.close()
+            raise
+        conn = PeerConnection(s)
+        if self.binary:
+            try:
+                conn.negotiate()
+            except BaseException:
+                conn.close()
+                raise
+        return conn
@@ -0,0 +1,173 @@
+import contextlib
+import glob
+import io
+import os
+import threading
+import time
+
+CHECK_INTERVAL = 1.0
+
+
+class Profiler:
+    """
+    Opt-in cProfile sampling of the command hot path for a bounded time window.
+
+    The window is stored in a control file shared by all processes, so starting it
+    from one connection switches profiling on in every handler and worker. Each
+    thread uses its own cProfile.Profile. Python 3.12+ allows only one active
+    profiler per process, there a block whose profiler cannot be enabled runs
+    unprofiled. When the window ends each process writes its profile to
+    "<pid>.prof", and report() merges all of them into one report. cProfile and
+    pstats are imported only once a window is opened or a report is made.
+    """
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): Directory for the control file, per-process profiles and the report.
+        """
+        self.directory = directory
+        self.control_file = os.path.join(directory, "active")
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiles = []
+        self.deadline = 0.0
+        self.next_check = 0.0
+
+    def start(self, window):
+        """
+        Switches profiling on in all processes for the given number of seconds.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for path in glob.glob(os.path.join(self.directory, "*.prof")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with open(self.control_file, "w") as f:
+            f.write(str(time.time() + window))
+        self.next_check = 0.0
+
+    def stop(self):
+        """
+        Switches profiling off in all processes.
+        """
+        try:
+            os.remove(self.control_file)
+        except OSError:
+            pass
+        self.next_check = 0.0
+        self.dump()
+
+    def active(self):
+        """
+        Returns True while the profiling window is open.
+        The control file is read at most once per CHECK_INTERVAL.
+        """
+        if self.pid != os.getpid():
+            self._reset()
+
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.next_check = now + CHECK_INTERVAL
+            was_active = self.deadline > time.time()
+            try:
+                with open(self.control_file, "r") as f:
+                    self.deadline = float(f.read())
+            except (OSError, ValueError):
+                self.deadline = 0.0
+            if was_active and self.deadline <= time.time():
+                self.dump()
+
+        return self.deadline > time.time()
+
+    @contextlib.contextmanager
+    def profile(self):
+        """
+        Profiles the enclosed block in the current thread while the window is open.
+        """
+        if not self.active():
+            yield
+            return
+
+        profile = getattr(self.local, "profile", None)
+        if profile is None:
+            import cProfile
+            profile = cProfile.Profile()
+            self.local.profile = profile
+            with self.lock:
+                self.profiles.append(profile)
+
+        try:
+            profile.enable()
+            enabled = True
+        except ValueError:
+            # Another thread's profiler is active (Python 3.12+).
+            enabled = False
+
+        if not enabled:
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def dump(self):
+        """
+        Writes the profiles collected by this process to "<pid>.prof".
+        """
+        with self.lock:
+            profiles = self.profiles
+            self.profiles = []
+            self.local = threading.local()
+        if not profiles:
+            return
+
+        import pstats
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # The profile recorded nothing.
+                continue
+
+        if stats is None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        stats.dump_stats(os.path.join(self.directory, f"{os.getpid()}.prof"))
+
+    def report(self, limit=40):
+        """
+        Merges the profiles of all processes into "report.txt".
+
+        Returns:
+            str: Path of the report, or None if no profile was collected.
+        """
+        self.dump()
+        paths = glob.glob(os.path.join(self.directory, "*.prof"))
+        if not paths:
+            return None
+
+        import pstats
+        out = io.StringIO()
+        stats = pstats.Stats(paths[0], stream=out)
+        for path in paths[1:]:
+            stats.add(path)
+        out.write(f"Merged profiles of {len(paths)} process(es)\n\n")
+        stats.sort_stats("cumulative").print_stats(limit)
+
+        report_path = os.path.join(self.directory, "report.txt")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(out.getvalue())
+        return report_path
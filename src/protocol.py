@@ -0,0 +1,157 @@
+import struct
+
+from binary_protocol import NEGOTIATE, FrameTooLongError, next_frame, decode_request, encode_response
+
+RECV_SIZE = 4096
+MAX_LINE = 65536
+
+
+class LineTooLongError(ValueError):
+    """
+    Raised when a client sends more than MAX_LINE bytes without a line terminator.
+    """
+
+
+class LineBuffer:
+    """
+    Reassembles CRLF (or LF) terminated commands from arbitrary chunks of a TCP stream.
+    Several commands in one chunk are split apart, a command spread over several
+    chunks is kept until its terminator arrives.
+    """
+
+    def __init__(self, max_line=MAX_LINE):
+        self.buffer = bytearray()
+        self.max_line = max_line
+
+    def feed(self, data):
+        """
+        Appends received bytes and returns all commands completed by them.
+
+        Args:
+            data (bytes): Chunk received from the socket.
+
+        Returns:
+            list: Complete non-empty command lines, in the order they were sent.
+
+        Raises:
+            LineTooLongError: If the unterminated remainder exceeds max_line.
+        """
+        self.buffer += data
+        lines = []
+
+        while True:
+            line = self.next_line()
+            if line is None:
+                break
+            lines.append(line)
+
+        self.check_length()
+        return lines
+
+    def next_line(self):
+        """
+        Removes and returns the next complete non-empty line, or None if there is none.
+        """
+        while True:
+            end = self.buffer.find(b"\n")
+            if end == -1:
+                return None
+            line = self.buffer[:end].decode(errors="replace").strip()
+            del self.buffer[:end + 1]
+            if line:
+                return line
+
+    def check_length(self):
+        """
+        Raises:
+            LineTooLongError: If the unterminated remainder exceeds max_line.
+        """
+        if len(self.buffer) > self.max_line:
+            self.buffer.clear()
+            raise LineTooLongError("ER Command is too long.")
+
+
+class ResponseBuffer:
+    """
+    Connection stand-in that collects everything Commands sends,
+    so the caller can write the responses to the real transport itself.
+    """
+
+    def __init__(self):
+        self.response = bytearray()
+
+    def sendall(self, data):
+        """
+        Captures the data sent by the command execution.
+        """
+        self.response += data
+
+
+class Session:
+    """
+    Protocol state of one client connection.
+    The connection starts with CRLF terminated text commands. After the client sends
+    "BP 1" (and receives "BP 1") it switches to length-prefixed binary frames.
+    """
+
+    def __init__(self):
+        self.lines = LineBuffer()
+        self.binary = False
+
+    def process(self, commands, data, addr):
+        """
+        Executes all commands completed by the received data, in order, and returns
+        all responses as one block, so they can be written with a single send.
+
+        Args:
+            commands (Commands): Command dispatcher.
+            data (bytes): Chunk received from the socket.
+            addr (str): Source identifier for logging.
+
+        Returns:
+            bytes: Concatenated responses.
+
+        Raises:
+            LineTooLongError: If a text command or a binary frame exceeds MAX_LINE.
+        """
+        self.lines.buffer += data
+        out = ResponseBuffer()
+
+        while not self.binary:
+            line = self.lines.next_line()
+            if line is None:
+                self.lines.check_length()
+                break
+            if line.upper() == NEGOTIATE:
+                out.sendall(f"{NEGOTIATE}\r\n".encode())
+                self.binary = True
+            else:
+                commands.execute(line, out, addr=addr)
+
+        while self.binary:
+            try:
+                payload = next_frame(self.lines.buffer, self.lines.max_line)
+            except FrameTooLongError as e:
+                raise LineTooLongError(str(e))
+            if payload is None:
+                break
+            out.sendall(self._execute_frame(commands, payload, addr))
+
+        return bytes(out.response)
+
+    @staticmethod
+    def _execute_frame(commands, payload, addr):
+        if not payload:
+            return encode_response(0, "ER Unknown command")
+
+        try:
+            opcode, text = decode_request(payload)
+        except (ValueError, struct.error) as e:
+            message = str(e) if str(e).startswith("ER") else "ER Malformed frame."
+            return encode_response(payload[0], message)
+        if not text:
+            return encode_response(opcode, "ER Unknown command")
+
+        buffer = ResponseBuffer()
+        commands.execute(text, buffer, addr=addr)
+        return encode_response(opcode, bytes(buffer.response).decode().strip())
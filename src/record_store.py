@@ -0,0 +1,386 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+
+from storage import ACCOUNT_MIN, ACCOUNT_MAX, AccountSpaceExhaustedError, NumberAllocator, account_number, load_accounts
+
+MAGIC = b"P2PACCT1"
+# Magic, account count, balance total, bank IP (NUL padded).
+HEADER = struct.Struct("<8sqq48s")
+# Existence flag and balance, padded to 16 bytes so every balance is 8-byte aligned.
+SLOT = struct.Struct("<B7xq")
+SLOTS = ACCOUNT_MAX - ACCOUNT_MIN + 1
+FILE_SIZE = HEADER.size + SLOTS * SLOT.size
+INT64_MIN = -(2 ** 63)
+INT64_MAX = 2 ** 63 - 1
+
+
+class RecordStore:
+    """
+    Account table kept in a memory-mapped file with one fixed-width slot per account number.
+
+    Slot i holds the account ACCOUNT_MIN + i, so reading or updating an account is a
+    single unpack or pack at a computed offset. The header keeps the number of
+    accounts and the sum of balances up to date, so BA and BN read two integers.
+    All accounts belong to the bank IP stored in the header. An empty table takes the
+    IP of its first account, creating or setting an account of another IP is rejected
+    and removing one is ignored. Accounts are moved to a new bank IP only by exporting
+    and importing them.
+
+    The file is mapped shared, so every process sees the writes of the others as soon
+    as they are made. Every access takes the shared lock. Changes are written to the
+    page cache only, they reach the disk when the kernel writes the pages back or on
+    compact() and close(). With a GroupCommit every mutation returns only after the
+    mapping has been flushed. A batch is atomic for other processes, not across a crash.
+
+    Offers the same methods as AccountStore.
+    """
+
+    def __init__(self, path, lock=None, compact_every=1000, metrics=None, group_commit=None):
+        """
+        Args:
+            path (str): Path of the legacy JSON account file (e.g. "accounts.json").
+                The record file is created next to it as "accounts.dat".
+            lock (multiprocessing.RLock, optional): Lock shared by all processes using the file.
+            compact_every (int): Unused, accepted for compatibility with AccountStore.
+            metrics (Metrics, optional): Unused, accepted for compatibility with AccountStore.
+            group_commit (GroupCommit, optional): Makes every mutation durable before it returns.
+        """
+        base, _ = os.path.splitext(path)
+        self.legacy_file = path
+        self.record_file = base + ".dat"
+        self.lock = lock if lock is not None else threading.RLock()
+        self.metrics = metrics
+        self.group_commit = group_commit
+
+        self.fd = None
+        self.map = None
+        self.allocator = None
+
+    def sync(self):
+        """
+        Maps the record file. On first use the file is created from the accounts
+        of the JSON store next to it.
+        """
+        with self.lock:
+            self._open()
+
+    def get(self, key, default=None):
+        with self.lock:
+            self._open()
+            offset = self._offset(key)
+            if offset is None:
+                return default
+            used, balance = SLOT.unpack_from(self.map, offset)
+            return balance if used else default
+
+    def create(self, ip):
+        """
+        Creates an account with a zero balance under an unused number.
+
+        Args:
+            ip (str): Bank IP, the second part of the account key.
+
+        Returns:
+            str: The new account key.
+
+        Raises:
+            AccountSpaceExhaustedError: If every account number is in use.
+            ValueError: If the table holds accounts of another bank IP.
+        """
+        with self.lock:
+            self._open()
+            count = self._header()[1]
+            if count and ip != self._ip():
+                raise ValueError(f"Accounts belong to bank {self._ip()}, move them by export and import.")
+            while True:
+                if count >= SLOTS:
+                    raise AccountSpaceExhaustedError("ER No free account numbers left.")
+                try:
+                    number = self.allocator.take()
+                except AccountSpaceExhaustedError:
+                    # Numbers released by other processes are only seen in the file.
+                    self.allocator = self._scan_allocator()
+                    continue
+                if not SLOT.unpack_from(self.map, self._slot(number))[0]:
+                    break
+            key = f"{number}/{ip}"
+            self._apply(["S", key, 0])
+        self._wait_durable()
+        return key
+
+    def set(self, key, value):
+        """
+        Sets the balance of an account.
+
+        Raises:
+            ValueError: If the number is out of range or the key's IP is not the table's IP.
+        """
+        self._mutate(["S", key, value])
+
+    def delete(self, key):
+        """
+        Removes an account.
+        """
+        self._mutate(["D", key])
+
+    def apply(self, changes):
+        """
+        Applies several changes under one lock, so other processes see all of them or none.
+
+        Args:
+            changes (list): Records such as ["S", key, balance] or ["D", key].
+        """
+        self._mutate(["B", changes])
+
+    def total(self):
+        with self.lock:
+            self._open()
+            return self._header()[2]
+
+    def count(self):
+        with self.lock:
+            self._open()
+            return self._header()[1]
+
+    def verify(self):
+        """
+        Recomputes the total and the count from all slots and corrects the header.
+
+        Returns:
+            tuple: (tracked total, actual total, tracked count, actual count).
+        """
+        with self.lock:
+            self._open()
+            _, tracked_count, tracked_total, _ = self._header()
+            total = 0
+            count = 0
+            for used, balance in SLOT.iter_unpack(memoryview(self.map)[HEADER.size:]):
+                if used:
+                    total += balance
+                    count += 1
+            self._write_header(count, total)
+            return tracked_total, total, tracked_count, count
+
+    def snapshot(self):
+        """
+        Returns a copy of all accounts as a dict of key -> balance.
+        """
+        with self.lock:
+            self._open()
+            ip = self._ip()
+            return {
+                f"{ACCOUNT_MIN + i}/{ip}": balance
+                for i, (used, balance) in enumerate(SLOT.iter_unpack(memoryview(self.map)[HEADER.size:]))
+                if used
+            }
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def compact(self):
+        """
+        Writes the mapped pages to disk.
+        """
+        with self.lock:
+            if self.map is not None:
+                self.map.flush()
+
+    def close(self):
+        """
+        Writes the mapped pages to disk and unmaps the file.
+        """
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _open(self):
+        if self.map is not None:
+            return
+        if not os.path.exists(self.record_file):
+            write_records(load_accounts(self.legacy_file), self.record_file)
+        self.fd = os.open(self.record_file, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        self.map = mmap.mmap(self.fd, FILE_SIZE)
+        if self._header()[0] != MAGIC:
+            raise ValueError(f"{self.record_file} is not an account record file.")
+        self.allocator = self._scan_allocator()
+
+    def _scan_allocator(self):
+        used = {
+            ACCOUNT_MIN + i
+            for i, (flag, _) in enumerate(SLOT.iter_unpack(memoryview(self.map)[HEADER.size:]))
+            if flag
+        }
+        return NumberAllocator.from_used(used)
+
+    def _mutate(self, record):
+        with self.lock:
+            self._open()
+            self._apply(record)
+        self._wait_durable()
+
+    def _wait_durable(self):
+        if self.group_commit is not None:
+            self.group_commit.wait(self._flush)
+
+    def _flush(self):
+        with self.lock:
+            mapping = self.map
+        if mapping is not None:
+            mapping.flush()
+
+    def _apply(self, record):
+        """
+        Checks all changes of a record and writes them only if every one is valid,
+        so a rejected change leaves the slots and the header untouched.
+
+        Raises:
+            ValueError: If a key is invalid or belongs to another bank.
+            OverflowError: If a balance or the total does not fit 64 bits.
+        """
+        changes = record[1] if record[0] == "B" else [record]
+        _, count, total, _ = self._header()
+        table_ip = self._ip()
+        slots = {}
+
+        for change in changes:
+            number = account_number(change[1])
+            if number is None or "/" not in change[1] or not ACCOUNT_MIN <= number <= ACCOUNT_MAX:
+                raise ValueError(f"Account number {change[1]} is out of range.")
+
+            ip = change[1].split("/", 1)[1]
+            used, previous = slots.get(number) or SLOT.unpack_from(self.map, self._slot(number))
+
+            if change[0] == "S":
+                balance = change[2]
+                if not INT64_MIN <= balance <= INT64_MAX:
+                    raise OverflowError("Balance out of range.")
+                if ip != table_ip:
+                    if count:
+                        raise ValueError(f"Account {change[1]} does not belong to bank {table_ip}.")
+                    table_ip = ip
+                count += 0 if used else 1
+                total += balance - (previous if used else 0)
+                slots[number] = (1, balance)
+            elif change[0] == "D" and used and ip == table_ip:
+                count -= 1
+                total -= previous
+                slots[number] = (0, 0)
+
+        if not INT64_MIN <= total <= INT64_MAX:
+            raise OverflowError("Total of all balances out of range.")
+
+        for number, (used, balance) in slots.items():
+            SLOT.pack_into(self.map, self._slot(number), used, balance)
+            if not used:
+                self.allocator.release(number)
+        HEADER.pack_into(self.map, 0, MAGIC, count, total, table_ip.encode())
+
+    def _offset(self, key):
+        number = account_number(key)
+        if number is None or not ACCOUNT_MIN <= number <= ACCOUNT_MAX:
+            return None
+        if key.split("/", 1)[1:] != [self._ip()]:
+            return None
+        return self._slot(number)
+
+    @staticmethod
+    def _slot(number):
+        return HEADER.size + (number - ACCOUNT_MIN) * SLOT.size
+
+    def _header(self):
+        return HEADER.unpack_from(self.map, 0)
+
+    def _ip(self):
+        return self._header()[3].rstrip(b"\0").decode()
+
+    def _write_header(self, count, total):
+        HEADER.pack_into(self.map, 0, MAGIC, count, total, self._ip().encode())
+
+
+def write_records(accounts, path):
+    """
+    Writes a record file holding the given accounts, replacing the file atomically.
+
+    Args:
+        accounts (dict): Account key -> balance, all keys must share one bank IP.
+        path (str): Record file to write.
+
+    Raises:
+        ValueError: If an account number is out of range or the keys use several IPs.
+    """
+    ips = {key.split("/", 1)[1] for key in accounts}
+    if len(ips) > 1:
+        raise ValueError(f"Accounts belong to several banks: {', '.join(sorted(ips))}.")
+
+    data = bytearray(FILE_SIZE)
+    total = 0
+    for key, balance in accounts.items():
+        number = account_number(key)
+        if number is None or not ACCOUNT_MIN <= number <= ACCOUNT_MAX:
+            raise ValueError(f"Account number {key} is out of range.")
+        SLOT.pack_into(data, RecordStore._slot(number), 1, balance)
+        total += balance
+    HEADER.pack_into(data, 0, MAGIC, len(accounts), total, (ips.pop() if ips else "").encode())
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def import_json(json_path, record_path):
+    """
+    Converts the accounts of a JSON store (legacy file, or its snapshot and journal) into a record file.
+
+    Returns:
+        int: Number of imported accounts.
+    """
+    accounts = load_accounts(json_path)
+    write_records(accounts, record_path)
+    return len(accounts)
+
+
+def export_json(record_path, json_path):
+    """
+    Writes the accounts of a record file as a JSON dict of "number/ip": balance.
+
+    Returns:
+        int: Number of exported accounts.
+    """
+    if not os.path.exists(record_path):
+        raise FileNotFoundError(record_path)
+
+    base, _ = os.path.splitext(record_path)
+    store = RecordStore(base + ".json")
+    store.record_file = record_path
+    try:
+        accounts = store.snapshot()
+    finally:
+        store.close()
+
+    tmp = json_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(accounts, f, indent=4)
+    os.replace(tmp, json_path)
+    return len(accounts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert accounts between the JSON and the record file format.")
+    parser.add_argument("action", choices=["import", "export"], help="import: JSON -> records, export: records -> JSON")
+    parser.add_argument("json_file", help="JSON account file, e.g. accounts.json")
+    parser.add_argument("record_file", help="Record file, e.g. accounts.dat")
+    options = parser.parse_args()
+
+    if options.action == "import":
+        print(f"Imported {import_json(options.json_file, options.record_file)} accounts.")
+    else:
+        print(f"Exported {export_json(options.record_file, options.json_file)} accounts.")
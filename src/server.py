@@ -0,0 +1,62 @@
+"""
+Headless entry point of the bank: runs only the server, without the GUI.
+
+Prints "READY <host>:<port> <pid>" to stdout as soon as clients can connect and
+optionally writes the pid to a pidfile. SIGTERM stops accepting connections, lets
+the commands in flight finish (for at most "drain_timeout" seconds) and exits.
+
+Example:
+    python src/server.py --pidfile /run/p2p-bank.pid
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+from main import run_server_process, BANK_IDENTITY
+
+
+def write_pidfile(path):
+    """
+    Writes the pid of this process to a file, replacing it atomically.
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(f"{os.getpid()}\n")
+    os.replace(tmp, path)
+
+
+def remove_pidfile(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the P2P bank server without the GUI.")
+    parser.add_argument("--pidfile", help="Write the server pid to this file once it is ready")
+    options = parser.parse_args()
+
+    started = []
+
+    def ready(host, port):
+        if options.pidfile:
+            write_pidfile(options.pidfile)
+        started.append((host, port))
+        print(f"READY {host}:{port} {os.getpid()}", flush=True)
+
+    BANK_IDENTITY.get()
+    try:
+        run_server_process(ready=ready)
+    finally:
+        if options.pidfile and started:
+            remove_pidfile(options.pidfile)
+
+    if not started:
+        print("ERROR Server could not be started, is the port in use?", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
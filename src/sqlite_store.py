@@ -0,0 +1,303 @@
+import os
+import sqlite3
+import threading
+import time
+
+from storage import AccountSpaceExhaustedError, NumberAllocator, account_number, load_accounts
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS accounts (number INTEGER PRIMARY KEY, ip TEXT NOT NULL, balance INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL, count INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO totals (id, total, count) VALUES (0, 0, 0)",
+    """CREATE TRIGGER IF NOT EXISTS accounts_insert AFTER INSERT ON accounts BEGIN
+        UPDATE totals SET total = total + NEW.balance, count = count + 1 WHERE id = 0;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS accounts_update AFTER UPDATE OF balance ON accounts BEGIN
+        UPDATE totals SET total = total + NEW.balance - OLD.balance WHERE id = 0;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS accounts_delete AFTER DELETE ON accounts BEGIN
+        UPDATE totals SET total = total - OLD.balance, count = count - 1 WHERE id = 0;
+    END""",
+]
+
+SELECT_BALANCE = "SELECT balance FROM accounts WHERE number = ? AND ip = ?"
+SELECT_USED = "SELECT number FROM accounts"
+SELECT_EXISTS = "SELECT 1 FROM accounts WHERE number = ?"
+SELECT_TOTALS = "SELECT total, count FROM totals WHERE id = 0"
+SELECT_ACTUAL = "SELECT COALESCE(SUM(balance), 0), COUNT(*) FROM accounts"
+SELECT_ALL = "SELECT number, ip, balance FROM accounts"
+UPSERT = (
+    "INSERT INTO accounts (number, ip, balance) VALUES (?, ?, ?) "
+    "ON CONFLICT (number) DO UPDATE SET ip = excluded.ip, balance = excluded.balance"
+)
+DELETE = "DELETE FROM accounts WHERE number = ? AND ip = ?"
+FIX_TOTALS = "UPDATE totals SET total = ?, count = ? WHERE id = 0"
+
+
+class SQLiteStore:
+    """
+    Account table in an SQLite database in WAL mode.
+
+    Balance changes are single-row upserts and deletes, a batch runs in one
+    transaction. Triggers keep the total and the count in a one-row table in the
+    same transaction, so BA and BN read one row. In WAL mode readers see the last
+    committed state without waiting for a writer, so the shared lock is only taken
+    to create the database and to hand out account numbers. Every thread of every process uses its own connection,
+    SQL strings are constant so the connection's statement cache reuses the
+    prepared statements. Commits run with synchronous=NORMAL, so SQLite does not
+    sync the WAL itself. With a GroupCommit every mutation waits until the WAL is
+    fsynced, concurrent commits of the process share one fsync.
+
+    Offers the same methods as AccountStore.
+    """
+
+    def __init__(self, path, lock=None, compact_every=1000, metrics=None, group_commit=None):
+        """
+        Args:
+            path (str): Path of the legacy JSON account file (e.g. "accounts.json").
+                The database is created next to it as "accounts.db".
+            lock (multiprocessing.RLock, optional): Lock shared by all processes using the database.
+            compact_every (int): WAL pages after which SQLite checkpoints the WAL into the database.
+            metrics (Metrics, optional): Receives the time spent on queries as "storage.io".
+            group_commit (GroupCommit, optional): Makes every mutation durable before it returns.
+        """
+        base, _ = os.path.splitext(path)
+        self.legacy_file = path
+        self.db_file = base + ".db"
+        self.wal_file = self.db_file + "-wal"
+        self.lock = lock if lock is not None else threading.RLock()
+        self.compact_every = max(1, int(compact_every))
+        self.metrics = metrics
+        self.group_commit = group_commit
+
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.allocator = None
+        self.pid = None
+
+    def sync(self):
+        """
+        Opens the connection of the current thread, creating the database on first use.
+        """
+        self._connection()
+
+    def get(self, key, default=None):
+        number = account_number(key)
+        if number is None or "/" not in key:
+            return default
+        row = self._query(SELECT_BALANCE, (number, key.split("/", 1)[1])).fetchone()
+        return row[0] if row else default
+
+    def create(self, ip):
+        """
+        Creates an account with a zero balance under an unused number.
+
+        Args:
+            ip (str): Bank IP, the second part of the account key.
+
+        Returns:
+            str: The new account key.
+
+        Raises:
+            AccountSpaceExhaustedError: If every account number is in use.
+        """
+        connection = self._connection()
+        with self.lock:
+            rescanned = False
+            while True:
+                try:
+                    number = self.allocator.take()
+                except AccountSpaceExhaustedError:
+                    # Numbers released by other processes are only seen in the database.
+                    if rescanned:
+                        raise
+                    self.allocator = self._scan_allocator(connection)
+                    rescanned = True
+                    continue
+                if self._query(SELECT_EXISTS, (number,)).fetchone() is None:
+                    break
+            key = f"{number}/{ip}"
+            self._query(UPSERT, (number, ip, 0))
+        self._wait_durable()
+        return key
+
+    def set(self, key, value):
+        """
+        Sets the balance of an account in one statement.
+        """
+        self._query(UPSERT, (account_number(key), key.split("/", 1)[1], value))
+        self._wait_durable()
+
+    def delete(self, key):
+        """
+        Removes an account in one statement.
+        """
+        if self._query(DELETE, (account_number(key), key.split("/", 1)[1])).rowcount:
+            with self.lock:
+                self.allocator.release(account_number(key))
+        self._wait_durable()
+
+    def apply(self, changes):
+        """
+        Applies several changes in one transaction.
+
+        Args:
+            changes (list): Records such as ["S", key, balance] or ["D", key].
+        """
+        connection = self._connection()
+        start = time.perf_counter()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for change in changes:
+                number = account_number(change[1])
+                ip = change[1].split("/", 1)[1]
+                if change[0] == "S":
+                    connection.execute(UPSERT, (number, ip, change[2]))
+                elif change[0] == "D":
+                    connection.execute(DELETE, (number, ip))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            self._observe(start)
+        self._wait_durable()
+
+        with self.lock:
+            for change in changes:
+                if change[0] == "D":
+                    self.allocator.release(account_number(change[1]))
+
+    def total(self):
+        return self._query(SELECT_TOTALS).fetchone()[0]
+
+    def count(self):
+        return self._query(SELECT_TOTALS).fetchone()[1]
+
+    def verify(self):
+        """
+        Recomputes the total and the count from the table and corrects the running values.
+
+        Returns:
+            tuple: (tracked total, actual total, tracked count, actual count).
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            tracked_total, tracked_count = connection.execute(SELECT_TOTALS).fetchone()
+            total, count = connection.execute(SELECT_ACTUAL).fetchone()
+            connection.execute(FIX_TOTALS, (total, count))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return tracked_total, total, tracked_count, count
+
+    def snapshot(self):
+        """
+        Returns a copy of all accounts as a dict of key -> balance.
+        """
+        return {f"{number}/{ip}": balance for number, ip, balance in self._query(SELECT_ALL)}
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def compact(self):
+        """
+        Checkpoints the WAL into the database file and truncates it.
+        """
+        self._query("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """
+        Closes the connections of all threads.
+        """
+        with self.connections_lock:
+            connections = self.connections
+            self.connections = []
+            self.local = threading.local()
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+
+    def _query(self, sql, params=()):
+        connection = self._connection()
+        start = time.perf_counter()
+        try:
+            return connection.execute(sql, params)
+        finally:
+            self._observe(start)
+
+    def _wait_durable(self):
+        if self.group_commit is not None:
+            self.group_commit.wait(self._fsync_wal)
+
+    def _fsync_wal(self):
+        """
+        Fsyncs the WAL, which covers every transaction committed to it so far.
+        A WAL that was checkpointed and removed meanwhile is already in the synced database.
+        """
+        try:
+            fd = os.open(self.wal_file, os.O_RDWR)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _observe(self, start):
+        if self.metrics is not None:
+            self.metrics.observe("storage.io", time.perf_counter() - start)
+
+    def _connection(self):
+        if self.pid != os.getpid():
+            # Connections must not be shared with a forked child.
+            self.pid = os.getpid()
+            self.local = threading.local()
+            self.connections = []
+            self.connections_lock = threading.Lock()
+            self.allocator = None
+
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            return connection
+
+        connection = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute(f"PRAGMA wal_autocheckpoint = {self.compact_every}")
+
+        with self.lock:
+            if connection.execute("PRAGMA user_version").fetchone()[0] == 0:
+                self._create(connection)
+            if self.allocator is None:
+                self.allocator = self._scan_allocator(connection)
+
+        self.local.connection = connection
+        with self.connections_lock:
+            self.connections.append(connection)
+        return connection
+
+    def _create(self, connection):
+        """
+        Creates the schema and imports the accounts of the JSON store next to the database.
+        """
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            for key, balance in load_accounts(self.legacy_file).items():
+                connection.execute(UPSERT, (account_number(key), key.split("/", 1)[1], balance))
+            connection.execute("PRAGMA user_version = 1")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _scan_allocator(connection):
+        return NumberAllocator.from_used({row[0] for row in connection.execute(SELECT_USED)})
@@ -0,0 +1,489 @@
+import json
+import os
+import random
+import threading
+import time
+
+ACCOUNT_MIN = 10000
+ACCOUNT_MAX = 99999
+
+
+class AccountSpaceExhaustedError(Exception):
+    """
+    Raised when every account number between ACCOUNT_MIN and ACCOUNT_MAX is in use.
+    """
+
+
+class NumberAllocator:
+    """
+    Hands out unused account numbers in constant time.
+    Free numbers are kept in a shuffled list with a position index, so taking,
+    reserving and releasing a number are all O(1).
+    """
+
+    def __init__(self, free):
+        """
+        Args:
+            free (list): Free account numbers in the order they will be handed out (from the end).
+        """
+        self.free = list(free)
+        self.index = {number: i for i, number in enumerate(self.free)}
+
+    @classmethod
+    def from_used(cls, used):
+        """
+        Builds an allocator with all numbers except the used ones, in random order.
+        """
+        free = [n for n in range(ACCOUNT_MIN, ACCOUNT_MAX + 1) if n not in used]
+        random.shuffle(free)
+        return cls(free)
+
+    def take(self):
+        """
+        Removes and returns a free number.
+
+        Raises:
+            AccountSpaceExhaustedError: If no number is free.
+        """
+        if not self.free:
+            raise AccountSpaceExhaustedError("ER No free account numbers left.")
+        number = self.free.pop()
+        del self.index[number]
+        return number
+
+    def reserve(self, number):
+        """
+        Marks a number as used (e.g. an account created by another process).
+        """
+        i = self.index.pop(number, None)
+        if i is None:
+            return
+        last = self.free.pop()
+        if last != number:
+            self.free[i] = last
+            self.index[last] = i
+
+    def release(self, number):
+        """
+        Returns a number of a removed account to a random position among the free ones.
+        """
+        if number is None or number in self.index or not ACCOUNT_MIN <= number <= ACCOUNT_MAX:
+            return
+        self.free.append(number)
+        i = random.randrange(len(self.free))
+        other = self.free[i]
+        self.free[i], self.free[-1] = number, other
+        self.index[other] = len(self.free) - 1
+        self.index[number] = i
+
+    def __len__(self):
+        return len(self.free)
+
+
+def account_number(key):
+    """
+    Returns the numeric part of an account key ("12345/10.0.0.1" -> 12345), or None.
+    """
+    try:
+        return int(key.split("/")[0])
+    except ValueError:
+        return None
+
+
+def load_accounts(path):
+    """
+    Reads the accounts of a store (its snapshot and journal, or the legacy JSON file)
+    without creating or modifying any file.
+
+    Args:
+        path (str): Path of the legacy JSON account file (e.g. "accounts.json").
+
+    Returns:
+        dict: Account key -> balance.
+    """
+    store = AccountStore(path)
+    store.allocator = NumberAllocator([])
+
+    if os.path.exists(store.snapshot_file):
+        with open(store.snapshot_file, "r") as f:
+            snapshot = json.load(f)
+        store.accounts = snapshot["accounts"]
+        store.generation = snapshot["generation"]
+    elif os.path.exists(path):
+        with open(path, "r") as f:
+            store.accounts = json.load(f)
+
+    try:
+        with open(store.journal_file, "rb") as f:
+            if store._read_generation(f.readline()) == store.generation:
+                store._replay(f)
+    except FileNotFoundError:
+        pass
+
+    return store.accounts
+
+
+class AccountStore:
+    """
+    In-memory account table backed by a snapshot file and an append-only journal.
+
+    Every mutation is appended to the journal as a single line, so a deposit costs
+    one small write instead of rewriting the whole account file. After a configured
+    number of journal records the table is compacted into a new snapshot and the
+    journal is started over.
+
+    The sum of balances and the number of accounts are kept up to date on every
+    applied record, so BA and BN do not have to scan the table. Free account
+    numbers are tracked by a NumberAllocator saved with every snapshot.
+
+    Several processes may share the same files. Every access takes the shared lock
+    and first replays records appended by other processes since the last access.
+    The lock is held only for the single read or write, so callers that check and
+    then update an account must serialize on that account themselves.
+
+    With a GroupCommit, every mutation returns only after the journal has been
+    fsynced, and snapshots are fsynced before they replace the old files.
+    """
+
+    def __init__(self, path, lock=None, compact_every=1000, metrics=None, group_commit=None):
+        """
+        Args:
+            path (str): Path of the legacy JSON account file (e.g. "accounts.json").
+                The snapshot and journal files are created next to it.
+            lock (multiprocessing.RLock, optional): Lock shared by all processes using the files.
+            compact_every (int): Number of journal records after which the journal
+                is compacted into a snapshot.
+            metrics (Metrics, optional): Receives the time spent on file I/O as "storage.io".
+            group_commit (GroupCommit, optional): Makes every mutation durable before it returns.
+        """
+        base, _ = os.path.splitext(path)
+        self.legacy_file = path
+        self.snapshot_file = base + ".snapshot.json"
+        self.journal_file = base + ".journal"
+        self.lock = lock if lock is not None else threading.RLock()
+        self.compact_every = max(1, int(compact_every))
+        self.metrics = metrics
+        self.group_commit = group_commit
+
+        self.accounts = {}
+        self.balance_total = 0
+        self.account_count = 0
+        self.allocator = None
+        self.generation = 0
+        self.offset = 0
+        self.pending = 0
+        self.loaded = False
+        self.journal_fd = None
+
+    def sync(self):
+        """
+        Brings the in-memory table up to date with the files on disk.
+        Loads the snapshot on first use, afterwards only reads new journal records.
+        """
+        with self.lock:
+            self._sync()
+
+    def get(self, key, default=None):
+        with self.lock:
+            self._sync()
+            return self.accounts.get(key, default)
+
+    def create(self, ip):
+        """
+        Creates an account with a zero balance under an unused number.
+
+        Args:
+            ip (str): Bank IP, the second part of the account key.
+
+        Returns:
+            str: The new account key.
+
+        Raises:
+            AccountSpaceExhaustedError: If every account number is in use.
+        """
+        with self.lock:
+            self._sync()
+            key = f"{self.allocator.take()}/{ip}"
+            self._mutate(["S", key, 0])
+        self._wait_durable()
+        return key
+
+    def set(self, key, value):
+        """
+        Sets the balance of an account and records the change in the journal.
+        """
+        self._mutate(["S", key, value])
+        self._wait_durable()
+
+    def delete(self, key):
+        """
+        Removes an account and records the removal in the journal.
+        """
+        self._mutate(["D", key])
+        self._wait_durable()
+
+    def apply(self, changes):
+        """
+        Applies several changes as one journal record, so other readers and crash
+        recovery see either all of them or none.
+
+        Args:
+            changes (list): Records such as ["S", key, balance] or ["D", key].
+        """
+        self._mutate(["B", changes])
+        self._wait_durable()
+
+    def total(self):
+        """
+        Returns the sum of all balances as of one consistent point in the journal.
+        """
+        with self.lock:
+            self._sync()
+            return self.balance_total
+
+    def count(self):
+        """
+        Returns the number of accounts as of one consistent point in the journal.
+        """
+        with self.lock:
+            self._sync()
+            return self.account_count
+
+    def verify(self):
+        """
+        Recomputes the total and the count from the table and corrects the running values.
+
+        Returns:
+            tuple: (tracked total, actual total, tracked count, actual count).
+        """
+        with self.lock:
+            self._sync()
+            tracked = (self.balance_total, self.account_count)
+            self.balance_total = sum(self.accounts.values())
+            self.account_count = len(self.accounts)
+            return tracked[0], self.balance_total, tracked[1], self.account_count
+
+    def snapshot(self):
+        """
+        Returns a copy of all accounts as a dict of key -> balance.
+        """
+        with self.lock:
+            self._sync()
+            return dict(self.accounts)
+
+    def __contains__(self, key):
+        with self.lock:
+            self._sync()
+            return key in self.accounts
+
+    def compact(self):
+        """
+        Writes the current table into a new snapshot and starts an empty journal.
+        Both files are replaced atomically, a crash in between only leaves journal
+        records that are already contained in the snapshot.
+        """
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        generation = self.generation + 1
+
+        tmp = self.snapshot_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"generation": generation, "accounts": self.accounts, "free": self.allocator.free}, f)
+            self._fsync_file(f)
+        os.replace(tmp, self.snapshot_file)
+
+        header = self._header(generation)
+        tmp = self.journal_file + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+            self._fsync_file(f)
+        os.replace(tmp, self.journal_file)
+        self._fsync_directory()
+
+        self.generation = generation
+        self.offset = len(header)
+        self.pending = 0
+        self._reopen_journal()
+
+    def _fsync_file(self, f):
+        if self.group_commit is not None:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _fsync_directory(self):
+        """
+        Makes the renames of a compaction durable (not supported on Windows).
+        """
+        if self.group_commit is None or not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.journal_file)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _wait_durable(self):
+        if self.group_commit is not None:
+            self.group_commit.wait(self._fsync_journal)
+
+    def _fsync_journal(self):
+        """
+        Fsyncs the journal. The descriptor is duplicated under the lock, so a compaction
+        may reopen the journal meanwhile, records written before it are in the fsynced snapshot.
+        """
+        with self.lock:
+            fd = os.dup(self.journal_fd)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """
+        Closes the journal file descriptor.
+        """
+        if self.journal_fd is not None:
+            os.close(self.journal_fd)
+            self.journal_fd = None
+
+    def _sync(self):
+        if self.metrics is None:
+            self._read_journal()
+            return
+        start = time.perf_counter()
+        self._read_journal()
+        self.metrics.observe("storage.io", time.perf_counter() - start)
+
+    def _read_journal(self):
+        if not self.loaded:
+            self._recover()
+            return
+
+        try:
+            with open(self.journal_file, "rb") as f:
+                if self._read_generation(f.readline()) != self.generation:
+                    self._recover()
+                    return
+                f.seek(self.offset)
+                self._replay(f)
+        except FileNotFoundError:
+            self._recover()
+
+    def _mutate(self, record):
+        """
+        Appends a record and applies it by replaying the journal, so the in-memory
+        table always follows the journal order, even if another process appended
+        a record at the same time.
+        """
+        with self.lock:
+            self._sync()
+            line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+            start = time.perf_counter()
+            os.write(self.journal_fd, line)
+            if self.metrics is not None:
+                self.metrics.observe("storage.io", time.perf_counter() - start)
+            self._sync()
+            if self.pending >= self.compact_every:
+                self._compact()
+
+    def _recover(self):
+        """
+        Rebuilds the table from the snapshot (or the legacy JSON file) and the journal.
+        """
+        self.accounts = {}
+        self.generation = 0
+        self.offset = 0
+        self.pending = 0
+
+        free = None
+
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r") as f:
+                snapshot = json.load(f)
+            self.accounts = snapshot["accounts"]
+            self.generation = snapshot["generation"]
+            free = snapshot.get("free")
+        elif os.path.exists(self.legacy_file):
+            with open(self.legacy_file, "r") as f:
+                self.accounts = json.load(f)
+
+        used = {account_number(key) for key in self.accounts}
+        if free is None:
+            self.allocator = NumberAllocator.from_used(used)
+        else:
+            self.allocator = NumberAllocator(n for n in free if n not in used)
+
+        self.balance_total = sum(self.accounts.values())
+        self.account_count = len(self.accounts)
+        self.loaded = True
+
+        try:
+            with open(self.journal_file, "rb") as f:
+                journal_generation = self._read_generation(f.readline())
+                self.offset = f.tell()
+                self._replay(f)
+        except FileNotFoundError:
+            journal_generation = None
+
+        if journal_generation != self.generation:
+            self._compact()
+            return
+
+        if self.offset < os.path.getsize(self.journal_file):
+            with open(self.journal_file, "r+b") as f:
+                f.truncate(self.offset)
+
+        self._reopen_journal()
+
+    def _replay(self, f):
+        """
+        Applies complete journal records from the current file position.
+        A torn record at the end of the file is left for a later sync.
+        """
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+
+            self._apply(record)
+            self.offset += len(line)
+            self.pending += 1
+
+    def _apply(self, record):
+        if record[0] == "S":
+            previous = self.accounts.get(record[1])
+            if previous is None:
+                self.account_count += 1
+                self.allocator.reserve(account_number(record[1]))
+                previous = 0
+            self.balance_total += record[2] - previous
+            self.accounts[record[1]] = record[2]
+        elif record[0] == "B":
+            for change in record[1]:
+                self._apply(change)
+        elif record[0] == "D":
+            previous = self.accounts.pop(record[1], None)
+            if previous is not None:
+                self.account_count -= 1
+                self.balance_total -= previous
+                self.allocator.release(account_number(record[1]))
+
+    def _reopen_journal(self):
+        self.close()
+        self.journal_fd = os.open(self.journal_file, os.O_WRONLY | os.O_APPEND | getattr(os, "O_BINARY", 0))
+
+    @staticmethod
+    def _header(generation):
+        return (json.dumps({"generation": generation}) + "\n").encode()
+
+    @staticmethod
+    def _read_generation(line):
+        try:
+            return json.loads(line)["generation"]
+        except (ValueError, KeyError, TypeError):
+            return None
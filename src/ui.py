@@ -1,9 +1,22 @@
 import tkinter as tk
 from tkinter import ttk
 import multiprocessing
+import queue
 import sys
-import os
+from concurrent.futures import ThreadPoolExecutor
 from command import Commands
+from log_tail import LogTail
+
+# Lines kept in the log widget and the page size when browsing older lines.
+LOG_WINDOW = 1000
+# Milliseconds between log refreshes, and while catching up with a large file.
+LOG_REFRESH_MS = 1000
+LOG_CATCH_UP_MS = 10
+# Commands executed at the same time, and milliseconds between checks for their results.
+COMMAND_WORKERS = 4
+RESULT_POLL_MS = 50
+# Lines kept in the command output.
+OUTPUT_LINES = 100
 
 
 class MockSocket:
@@ -55,6 +68,15 @@ class UI:
         self.root = root
         self.lock = multiprocessing.RLock()
         self.commands = Commands(self.lock)
+        self.log_tail = LogTail(self.commands.log_file, window=LOG_WINDOW)
+        self.follow_logs = True
+        self.log_first = 0
+        self.log_notice = False
+
+        self.executor = ThreadPoolExecutor(max_workers=COMMAND_WORKERS)
+        self.results = queue.Queue()
+        self.running = {}
+        self.next_job = 0
 
         self.notebook = ttk.Notebook(root)
         self.notebook.pack(expand=True, fill="both")
@@ -67,12 +89,14 @@ class UI:
         self.notebook.add(self.tab_cmd, text="Execute Commands")
         self.setup_command_tab()
 
-        self.refresh_logs()
+        self.schedule_log_refresh()
+        self.poll_results()
 
     def setup_log_tab(self):
         """
         Sets up the widgets for the Log Viewer tab.
-        Includes a text area for logs and buttons for Shutdown and Refresh.
+        Includes a text area for logs, buttons for paging through older lines and
+        buttons for Shutdown and Refresh.
         """
         frame_text = ttk.Frame(self.tab_logs)
         frame_text.pack(expand=True, fill="both", padx=10, pady=10)
@@ -88,7 +112,9 @@ class UI:
         frame_btns.pack(fill="x", padx=20, pady=10)
 
         tk.Button(frame_btns, text="Shutdown", command=self.shutdown).pack(side=tk.LEFT)
-        tk.Button(frame_btns, text="Refresh Logs", command=self.refresh_logs).pack(side=tk.RIGHT)
+        tk.Button(frame_btns, text="Refresh Logs", command=self.show_latest_logs).pack(side=tk.RIGHT)
+        tk.Button(frame_btns, text="Newer", command=self.page_logs_newer).pack(side=tk.RIGHT, padx=5)
+        tk.Button(frame_btns, text="Older", command=self.page_logs_older).pack(side=tk.RIGHT)
 
     def setup_command_tab(self):
         """
@@ -97,7 +123,7 @@ class UI:
         """
         self.cmd = ttk.Combobox(
             self.tab_cmd,
-            values=["BC", "AC", "AD", "AW", "AB", "AR", "BA", "BN"],
+            values=["BC", "AC", "AD", "AW", "AB", "AR", "BA", "BN", "BR"],
             state="readonly"
         )
         self.cmd.current(0)
@@ -117,28 +143,104 @@ class UI:
         self.lbl_amt = tk.Label(self.tab_cmd, text="Amount")
 
         tk.Button(self.tab_cmd, text="Send", command=self.send).place(x=560, y=190)
+        tk.Button(self.tab_cmd, text="Cancel", command=self.cancel).place(x=490, y=190)
         tk.Button(self.tab_cmd, text="Shutdown", command=self.shutdown).place(x=20, y=190)
 
+        self.status = tk.Label(self.tab_cmd, text="Idle")
+        self.status.place(x=110, y=193)
+        self.progress = ttk.Progressbar(self.tab_cmd, mode="indeterminate", length=150)
+        self.progress_shown = False
+
         self.update_fields()
 
+    def schedule_log_refresh(self):
+        """
+        Refreshes the log tab and schedules the next refresh, sooner while the
+        viewer is still catching up with a large file.
+        """
+        more = self.refresh_logs()
+        self.root.after(LOG_CATCH_UP_MS if more else LOG_REFRESH_MS, self.schedule_log_refresh)
+
     def refresh_logs(self):
         """
-        Reads the content of the log file and displays it in the log tab.
+        Reads the lines appended to the log file since the last refresh.
+        While following the end of the log, they are appended to the log tab and
+        the widget is trimmed to the newest LOG_WINDOW lines.
+
+        Returns:
+            bool: True if the file has more unread data.
+        """
+        try:
+            lines, replace, more = self.log_tail.poll()
+        except OSError as e:
+            self.set_log_text(f"Error reading log: {e}")
+            self.log_notice = True
+            return False
+
+        if not self.follow_logs:
+            return more
+
+        if not self.log_tail.exists():
+            self.set_log_text("Log file not found yet.")
+            self.log_notice = True
+            return more
+
+        if replace or (lines and self.log_notice):
+            self.set_log_text("")
+            self.log_notice = False
+        if lines:
+            self.log_display.insert(tk.END, "\n".join(lines) + "\n")
+            excess = int(self.log_display.index("end-1c").split(".")[0]) - 1 - LOG_WINDOW
+            if excess > 0:
+                self.log_display.delete("1.0", f"{excess + 1}.0")
+            self.log_display.see(tk.END)
+        return more
+
+    def set_log_text(self, text):
+        """
+        Replaces the content of the log tab.
         """
         self.log_display.delete("1.0", tk.END)
-        log_path = self.commands.log_file
+        self.log_display.insert(tk.END, text)
+
+    def show_log_page(self, first):
+        """
+        Stops following the log and shows LOG_WINDOW lines starting at the given line.
+        """
+        self.follow_logs = False
+        self.log_first = max(0, first)
+        self.set_log_text("\n".join(self.log_tail.read_lines(self.log_first, LOG_WINDOW)) + "\n")
+        self.log_display.see("1.0")
+
+    def page_logs_older(self):
+        """
+        Shows the page of lines before the current one.
+        """
+        if self.follow_logs:
+            self.log_first = max(0, self.log_tail.lines - LOG_WINDOW)
+        self.show_log_page(self.log_first - LOG_WINDOW)
 
-        if not os.path.exists(log_path):
-            self.log_display.insert(tk.END, "Log file not found yet.")
+    def page_logs_newer(self):
+        """
+        Shows the page of lines after the current one, or follows the log again at its end.
+        """
+        if self.follow_logs:
+            return
+        if self.log_first + 2 * LOG_WINDOW >= self.log_tail.lines:
+            self.show_latest_logs()
             return
+        self.show_log_page(self.log_first + LOG_WINDOW)
 
-        try:
-            with open(log_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                self.log_display.insert(tk.END, content)
-                self.log_display.see(tk.END)
-        except Exception as e:
-            self.log_display.insert(tk.END, f"Error reading log: {e}")
+    def show_latest_logs(self):
+        """
+        Shows the newest LOG_WINDOW lines and follows the log again.
+        """
+        self.follow_logs = True
+        self.refresh_logs()
+        lines = self.log_tail.read_lines(max(0, self.log_tail.lines - LOG_WINDOW), LOG_WINDOW)
+        if lines:
+            self.set_log_text("\n".join(lines) + "\n")
+            self.log_display.see(tk.END)
 
     def hide_all(self):
         """
@@ -174,7 +276,9 @@ class UI:
 
     def send(self):
         """
-        Constructs the command string from inputs and executes it via the Commands class.
+        Constructs the command string from inputs and queues it for a background worker.
+        The window stays responsive while the command (e.g. a forward to a slow bank)
+        runs, several commands may run at the same time.
         """
         c = self.cmd.get()
         acc = self.acc.get().strip()
@@ -182,35 +286,90 @@ class UI:
         amt = self.amount.get().strip()
 
         msg = ""
-        if c in ["BC", "BA", "BN","AC"]:
+        if c in ["BC", "BA", "BN", "AC", "BR"]:
             msg = c
         elif c in ["AB", "AR"]:
             msg = f"{c} {acc}/{ip_val}"
         elif c in ["AD", "AW"]:
             msg = f"{c} {acc}/{ip_val} {amt}"
 
+        self.next_job += 1
+        job = self.next_job
+        self.running[job] = (msg, self.executor.submit(self.run_command, job, msg))
+        self.update_status()
+
+    def run_command(self, job, msg):
+        """
+        Executes a command on a worker thread and queues its result for the Tk thread.
+        """
         fake_conn = MockSocket()
 
         try:
             self.commands.execute(msg, fake_conn, addr="GUI")
-
             result_text = fake_conn.response.decode().strip()
-            self.log_output(result_text)
-
         except Exception as e:
-            self.log_output(f"ER Internal Error: {e}")
+            result_text = f"ER Internal Error: {e}"
+
+        self.results.put((job, result_text))
+
+    def poll_results(self):
+        """
+        Shows the results of finished commands, runs on the Tk thread every RESULT_POLL_MS.
+        Results of cancelled commands are dropped.
+        """
+        try:
+            while True:
+                job, result_text = self.results.get_nowait()
+                entry = self.running.pop(job, None)
+                if entry is not None:
+                    self.log_output(f"{entry[0]} -> {result_text}")
+        except queue.Empty:
+            pass
+
+        self.update_status()
+        self.root.after(RESULT_POLL_MS, self.poll_results)
+
+    def cancel(self):
+        """
+        Cancels all running commands. Commands still waiting for a worker are not
+        executed, the results of commands already executing are ignored.
+        """
+        for msg, future in self.running.values():
+            future.cancel()
+            self.log_output(f"{msg} -> cancelled")
+        self.running.clear()
+        self.update_status()
+
+    def update_status(self):
+        """
+        Shows the number of running commands and animates the progress bar while there are any.
+        """
+        count = len(self.running)
+        self.status.config(text=f"Running: {count}" if count else "Idle")
+        if count and not self.progress_shown:
+            self.progress.place(x=200, y=195)
+            self.progress.start(10)
+        elif not count and self.progress_shown:
+            self.progress.stop()
+            self.progress.place_forget()
+        self.progress_shown = bool(count)
 
     def log_output(self, text):
         """
-        Updates the output text area in the Command tab.
+        Appends a line to the output text area in the Command tab, keeping the newest OUTPUT_LINES lines.
         """
-        self.output.delete("1.0", tk.END)
-        self.output.insert(tk.END, text)
+        self.output.insert(tk.END, text + "\n")
+        excess = int(self.output.index("end-1c").split(".")[0]) - 1 - OUTPUT_LINES
+        if excess > 0:
+            self.output.delete("1.0", f"{excess + 1}.0")
+        self.output.see(tk.END)
 
     def shutdown(self):
         """
-        Closes the application window.
+        Closes the application window. Queued commands are cancelled, running ones
+        finish before the process exits.
         """
+        self.executor.shutdown(wait=False, cancel_futures=True)
         self.root.destroy()
 
 
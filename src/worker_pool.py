@@ -0,0 +1,142 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import sys
+import time
+from async_server import run_async_server
+from config_loader import load_config
+
+CONFIG = load_config()
+WORKERS = CONFIG["workers"]
+DRAIN_TIMEOUT = CONFIG["drain_timeout"]
+RESTART_DELAY = 1.0
+# Seconds to wait for each worker to bind before the pool is reported as ready.
+BIND_TIMEOUT = 5.0
+
+
+def create_listener(host, port, reuse_port=False, listen=True):
+    """
+    Creates a bound, listening TCP socket.
+
+    Args:
+        host (str): Address to bind to.
+        port (int): Port to listen on.
+        reuse_port (bool): Sets SO_REUSEPORT so several processes can accept on the same port.
+        listen (bool): Starts listening, otherwise the socket is only bound.
+
+    Returns:
+        socket.socket: Listening socket.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.bind((host, port))
+        if listen:
+            s.listen()
+    except OSError:
+        s.close()
+        raise
+    return s
+
+
+def worker_main(lock, host, port, bound=None, admission=None):
+    """
+    Entry point of a pool worker.
+    Binds its own listener on the shared port and serves clients with the event loop.
+    SIGTERM drains the worker's connections (see async_server.serve).
+
+    Args:
+        bound (multiprocessing.Semaphore, optional): Released once the listener is bound.
+        admission (Admission, optional): Limits shared by all workers.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    try:
+        sock = create_listener(host, port, reuse_port=True)
+    except OSError:
+        return
+    if bound is not None:
+        bound.release()
+    run_async_server(lock, sock=sock, admission=admission)
+
+
+def pool_size():
+    """
+    Returns the number of workers to start.
+    A value of 0 in the config means one worker per CPU core.
+    Platforms without SO_REUSEPORT always get a single worker.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        return 1
+    return WORKERS if WORKERS > 0 else (os.cpu_count() or 1)
+
+
+def start_worker(lock, host, port, bound=None, admission=None):
+    p = multiprocessing.Process(target=worker_main, args=(lock, host, port, bound, admission), daemon=True)
+    p.start()
+    return p
+
+
+def run_worker_pool(lock, host, port, ready=None, admission=None):
+    """
+    Starts a pool of long-lived workers accepting on the same port and supervises them.
+    A worker that dies is replaced. Workers share the lock, so account operations
+    stay serialized across the whole pool. On SIGTERM every worker drains its
+    connections, workers still running after DRAIN_TIMEOUT seconds are killed.
+    The supervisor test-binds the port before starting any worker, so a port in use
+    (also by another pool) fails at once, and it returns if no worker binds within
+    BIND_TIMEOUT.
+
+    Args:
+        lock (StripedLock): Shared re-entrant lock with per-account stripes.
+        host (str): Address to bind to.
+        port (int): Port to listen on.
+        ready (callable, optional): Called with host and port once the workers are bound.
+        admission (Admission, optional): Limits shared by all workers, the per-IP
+            limit applies per worker.
+
+    Raises:
+        OSError: If the port cannot be bound.
+    """
+    # Without SO_REUSEPORT the bind also fails if another pool listens on the port.
+    create_listener(host, port, listen=False).close()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    bound = multiprocessing.Semaphore(0)
+    workers = {}
+    for _ in range(pool_size()):
+        p = start_worker(lock, host, port, bound, admission)
+        workers[p.sentinel] = (p, time.monotonic())
+
+    try:
+        bound_workers = 0
+        while bound_workers < len(workers) and bound.acquire(timeout=BIND_TIMEOUT):
+            bound_workers += 1
+        if not bound_workers:
+            return
+        if ready is not None:
+            ready(host, port)
+
+        while True:
+            for sentinel in multiprocessing.connection.wait(list(workers)):
+                p, started = workers.pop(sentinel)
+                p.join()
+
+                if time.monotonic() - started < RESTART_DELAY:
+                    time.sleep(RESTART_DELAY)
+
+                p = start_worker(lock, host, port, bound, admission)
+                workers[p.sentinel] = (p, time.monotonic())
+    finally:
+        for p, _ in workers.values():
+            p.terminate()
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        for p, _ in workers.values():
+            p.join(max(0.0, deadline - time.monotonic()))
+            if p.is_alive():
+                p.kill()
+                p.join()
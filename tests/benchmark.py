@@ -0,0 +1,306 @@
+"""
+Multi-node load test for the P2P bank.
+
+Starts several bank nodes on loopback addresses (127.0.0.1, 127.0.0.2, ...), each on
+its own port within BASE_PORT .. BASE_PORT + 10, so forwarded commands go through the
+normal port discovery. Drives a configurable mix of local and forwarded commands at a
+fixed concurrency and reports throughput and latency percentiles per command.
+
+Example:
+    python tests/benchmark.py --nodes 3 --concurrency 32 --duration 20 --remote 0.3 --output bench.json
+
+Loopback addresses other than 127.0.0.1 are available on Linux by default.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.abspath(os.path.join(current_dir, '..', 'src'))
+
+DEFAULT_MIX = "AD:35,AW:25,AB:30,BA:5,AC:5"
+NODE_CODE = "import sys; sys.path.insert(0, sys.argv[1]); import main; main.run_server_process()"
+
+
+def parse_mix(text):
+    """
+    Parses "AD:35,AW:25,..." into a list of (command, weight).
+    """
+    mix = []
+    for part in text.split(","):
+        cmd, weight = part.split(":")
+        mix.append((cmd.strip().upper(), float(weight)))
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class Node:
+    """
+    One bank node running in its own process and working directory,
+    its accounts, log, metrics and profiles are kept in that directory.
+    """
+
+    def __init__(self, index, base_port, server_mode, base_dir):
+        self.ip = f"127.0.0.{index + 1}"
+        self.port = base_port + index
+        self.dir = os.path.join(base_dir, f"node{index}")
+        os.makedirs(self.dir)
+
+        config = {
+            "port": self.port,
+            "peer_base_port": base_port,
+            "bank_ip": self.ip,
+            "server_mode": server_mode,
+            "p2p_timeout": 1.0,
+            "log_dir": os.path.join(self.dir, "log"),
+        }
+        self.config_path = os.path.join(self.dir, "config.json")
+        with open(self.config_path, "w") as f:
+            json.dump(config, f)
+
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", NODE_CODE, src_path],
+            cwd=self.dir,
+            env=dict(os.environ, P2P_CONFIG=self.config_path),
+            start_new_session=hasattr(os, "killpg")
+        )
+
+    def wait_ready(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection((self.ip, self.port), timeout=0.5):
+                    return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"Node {self.ip}:{self.port} did not start")
+
+    def stop(self):
+        if self.process is None:
+            return
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        else:
+            self.process.terminate()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class Client:
+    """
+    Text protocol client on one persistent connection.
+    """
+
+    def __init__(self, ip, port):
+        self.sock = socket.create_connection((ip, port), timeout=30)
+        self.buffer = b""
+
+    def request(self, command):
+        self.sock.sendall((command + "\r\n").encode())
+        while b"\n" not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError("Connection closed")
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return line.decode().strip()
+
+    def close(self):
+        self.sock.close()
+
+
+def prepare_accounts(nodes, per_node, balance):
+    """
+    Creates accounts with a starting balance on every node.
+
+    Returns:
+        dict: Node index -> list of account keys.
+    """
+    accounts = {}
+    for i, node in enumerate(nodes):
+        client = Client(node.ip, node.port)
+        keys = []
+        for _ in range(per_node):
+            key = client.request("AC").split()[1]
+            client.request(f"AD {key} {balance}")
+            keys.append(key)
+        client.close()
+        accounts[i] = keys
+    return accounts
+
+
+def worker(node_index, nodes, accounts, mix, remote, deadline, ops_limit, samples, lock, counter):
+    client = Client(nodes[node_index].ip, nodes[node_index].port)
+    commands = [cmd for cmd, _ in mix]
+    weights = [weight for _, weight in mix]
+    others = [i for i in range(len(nodes)) if i != node_index]
+    local_samples = []
+
+    try:
+        while time.monotonic() < deadline:
+            if ops_limit:
+                with lock:
+                    if counter[0] >= ops_limit:
+                        break
+                    counter[0] += 1
+
+            cmd = random.choices(commands, weights)[0]
+            forwarded = others and random.random() < remote
+            owner = random.choice(others) if forwarded else node_index
+            key = random.choice(accounts[owner])
+
+            if cmd in ("AD", "AW"):
+                message = f"{cmd} {key} {random.randint(1, 10)}"
+            elif cmd == "AB":
+                message = f"AB {key}"
+            else:
+                message = cmd
+                forwarded = False
+
+            start = time.perf_counter()
+            response = client.request(message)
+            elapsed = time.perf_counter() - start
+
+            name = f"{cmd}-remote" if forwarded else cmd
+            local_samples.append((name, elapsed, response.startswith("ER")))
+    finally:
+        client.close()
+        with lock:
+            samples.extend(local_samples)
+
+
+def summarize(samples, elapsed):
+    """
+    Aggregates samples into throughput and latency percentiles per command.
+    """
+    by_command = {}
+    for name, latency, error in samples:
+        entry = by_command.setdefault(name, {"latencies": [], "errors": 0})
+        entry["latencies"].append(latency)
+        entry["errors"] += int(error)
+
+    results = {}
+    for name, entry in sorted(by_command.items()):
+        latencies = sorted(entry["latencies"])
+        results[name] = {
+            "count": len(latencies),
+            "errors": entry["errors"],
+            "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "p999_ms": percentile(latencies, 0.999) * 1000,
+        }
+
+    return {
+        "total_ops": len(samples),
+        "elapsed_sec": elapsed,
+        "ops_per_sec": len(samples) / elapsed if elapsed else 0.0,
+        "commands": results,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=current_dir, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="P2P bank multi-node benchmark")
+    parser.add_argument("--nodes", type=int, default=3, help="number of bank nodes (max 11)")
+    parser.add_argument("--base-port", type=int, default=65525, help="port of the first node")
+    parser.add_argument("--server-mode", default="async", help="server_mode of the nodes")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--ops", type=int, default=0, help="stop after this many operations (0 = no limit)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="command weights, e.g. AD:35,AW:25,AB:30,BA:5,AC:5")
+    parser.add_argument("--remote", type=float, default=0.2, help="fraction of account commands sent to another node")
+    parser.add_argument("--accounts", type=int, default=100, help="accounts created per node")
+    parser.add_argument("--output", default="bench_results.json", help="file for machine-readable results")
+    args = parser.parse_args()
+
+    if not 1 <= args.nodes <= 11:
+        parser.error("--nodes must be between 1 and 11")
+
+    base_dir = tempfile.mkdtemp(prefix="p2p-bench-")
+    nodes = [Node(i, args.base_port, args.server_mode, base_dir) for i in range(args.nodes)]
+
+    try:
+        for node in nodes:
+            node.start()
+        for node in nodes:
+            node.wait_ready()
+
+        accounts = prepare_accounts(nodes, args.accounts, 1000000)
+        mix = parse_mix(args.mix)
+
+        samples = []
+        lock = threading.Lock()
+        counter = [0]
+        start = time.monotonic()
+        deadline = start + args.duration
+
+        threads = [
+            threading.Thread(
+                target=worker,
+                args=(i % len(nodes), nodes, accounts, mix, args.remote, deadline, args.ops, samples, lock, counter)
+            )
+            for i in range(args.concurrency)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        elapsed = time.monotonic() - start
+    finally:
+        for node in nodes:
+            node.stop()
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parameters": vars(args),
+        "results": summarize(samples, elapsed),
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    results = report["results"]
+    print(f"{results['total_ops']} ops in {results['elapsed_sec']:.2f}s = {results['ops_per_sec']:.0f} ops/s")
+    print(f"{'command':<12}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}")
+    for name, r in results["commands"].items():
+        print(f"{name:<12}{r['count']:>8}{r['errors']:>8}{r['ops_per_sec']:>10.0f}"
+              f"{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['p999_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
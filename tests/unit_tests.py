@@ -3,6 +3,13 @@ import sys
 import os
 import socket
 import json
+import asyncio
+import threading
+import queue
+import signal
+import subprocess
+import time
+import cProfile
 from unittest.mock import MagicMock, patch, mock_open
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -10,16 +17,54 @@ src_path = os.path.abspath(os.path.join(current_dir, '..', 'src'))
 sys.path.insert(0, src_path)
 
 from src import main
+from storage import AccountStore, NumberAllocator, AccountSpaceExhaustedError
+from record_store import RecordStore, import_json, export_json
+from sqlite_store import SQLiteStore
+from group_commit import GroupCommit
+from log_tail import LogTail
+from balance_cache import BalanceCache
+import async_server
+import worker_pool
+from protocol import LineBuffer, LineTooLongError
+from peer_pool import PeerPool
+from discovery import PortDiscovery
+from identity import BankIdentity, BANK_IP_ENV
+from bank_logger import LogWriter
+from locks import StripedLock
+from command import Commands
+from protocol import ResponseBuffer, Session
+import binary_protocol
+from forwarder import Forwarder
+from profiler import Profiler
+from admission import Admission, Gate, BUSY
+import command
+from metrics import Histogram
 
-CONFIG = {"port": 65525, "client_timeout": 60, "p2p_timeout": 1.0}
+CONFIG = {"port": 65525, "client_timeout": 60, "drain_timeout": 10,
+          "max_connections": 256, "max_connections_per_ip": 32, "max_forwards": 64,
+          "admission_queue_size": 64, "admission_queue_timeout": 5.0, "p2p_timeout": 1.0, "compact_every": 1000,
+          "storage": "journal", "durability": "none",
+          "group_commit_window": 0.001, "group_commit_max_batch": 64,
+          "server_mode": "process", "async_threads": 32, "workers": 0,
+          "peer_pool_size": 4, "peer_idle_timeout": 30,
+          "peer_port_ttl": 300, "peer_dead_ttl": 10,
+          "bank_ip": "", "ip_check_interval": 30,
+          "log_dir": "", "log_flush_interval": 0.2, "log_batch_size": 500, "log_queue_size": 10000,
+          "log_queue_policy": "block", "log_max_bytes": 10485760, "log_backups": 5,
+          "lock_stripes": 64, "forward_coalescing": False, "forward_window": 0.002,
+          "forward_max_batch": 64, "forward_timeout": 5.0, "binary_forwarding": True,
+          "balance_cache_ttl": 0, "balance_cache_size": 10000,
+          "peer_base_port": 0, "metrics": True, "metrics_dump_interval": 10,
+          "profiling": False, "profile_window": 60, "slow_command_ms": 500}
 CLIENT_TIMEOUT = CONFIG["client_timeout"]
 
 
 @pytest.fixture
-def mock_defaults(monkeypatch):
+def mock_defaults(monkeypatch, tmp_path):
     """Fixture to set default values in the main module."""
     monkeypatch.setattr(main, "CONFIG", CONFIG, raising=False)
     monkeypatch.setattr(main, "CLIENT_TIMEOUT", CLIENT_TIMEOUT, raising=False)
+    monkeypatch.setattr(command, "LOG_DIR", str(tmp_path / "log"))
 
 
 # Tests for load_config
@@ -80,4 +125,1034 @@ def test_handle_client_connection_reset(mock_defaults):
     with patch('main.Commands'):
         main.handle_client(mock_conn, addr, lock)
 
-        mock_conn.sendall.assert_not_called()
\ No newline at end of file
+        mock_conn.sendall.assert_not_called()
+
+
+def test_handle_client_pipelined_commands(mock_defaults, monkeypatch):
+    """Test: Several commands in one packet and one command split over packets"""
+    mock_conn = MagicMock()
+    mock_conn.__enter__.return_value = mock_conn
+    mock_conn.recv.side_effect = [b"BC\r\nBN\r\nAB 123", b"45/1.2.3.4\r\n", b""]
+
+    commands = MagicMock()
+    commands.execute.side_effect = lambda msg, conn, addr: conn.sendall(f"{msg}\r\n".encode())
+    monkeypatch.setattr(main, "Commands", MagicMock(return_value=commands))
+
+    main.handle_client(mock_conn, ("0.0.0.0", 65525), MagicMock())
+
+    executed = [c.args[0] for c in commands.execute.call_args_list]
+    assert executed == ["BC", "BN", "AB 12345/1.2.3.4"]
+    sent = [c.args[0] for c in mock_conn.sendall.call_args_list]
+    assert sent == [b"BC\r\nBN\r\n", b"AB 12345/1.2.3.4\r\n"]
+
+
+# Tests for LineBuffer
+def test_line_buffer_rejects_unterminated_flood():
+    """Test: Data without a line terminator is limited"""
+    lines = LineBuffer(max_line=8)
+    assert lines.feed(b"BC\r\n\r\nBN") == ["BC"]
+
+    with pytest.raises(LineTooLongError):
+        lines.feed(b"X" * 16)
+
+
+# Tests for AccountStore
+def test_store_imports_legacy_json(tmp_path):
+    """Test: Existing accounts.json is imported on first start"""
+    legacy = tmp_path / "accounts.json"
+    legacy.write_text(json.dumps({"12345/1.2.3.4": 100}))
+
+    store = AccountStore(str(legacy))
+    store.sync()
+
+    assert store.get("12345/1.2.3.4") == 100
+    assert (tmp_path / "accounts.snapshot.json").exists()
+    store.close()
+
+
+def test_store_recovers_from_journal(tmp_path):
+    """Test: Mutations survive a restart through snapshot and journal replay"""
+    path = str(tmp_path / "accounts.json")
+    store = AccountStore(path)
+    store.sync()
+    store.set("12345/1.2.3.4", 50)
+    store.set("54321/1.2.3.4", 0)
+    store.delete("54321/1.2.3.4")
+    store.close()
+
+    recovered = AccountStore(path)
+    recovered.sync()
+
+    assert dict(recovered.accounts) == {"12345/1.2.3.4": 50}
+    recovered.close()
+
+
+def test_store_sees_changes_from_other_instance(tmp_path):
+    """Test: A second store (another process) picks up appended and compacted records"""
+    path = str(tmp_path / "accounts.json")
+    first = AccountStore(path, compact_every=2)
+    second = AccountStore(path, compact_every=2)
+    first.sync()
+    second.sync()
+
+    first.set("12345/1.2.3.4", 10)
+    second.sync()
+    assert second.get("12345/1.2.3.4") == 10
+
+    first.set("12345/1.2.3.4", 20)
+    first.set("12345/1.2.3.4", 30)
+    second.sync()
+    assert second.get("12345/1.2.3.4") == 30
+
+    first.close()
+    second.close()
+
+
+
+# Tests for RecordStore
+def test_record_store_updates_slots_and_aggregates(tmp_path):
+    """Test: Records are created, updated and removed in place and survive reopening"""
+    path = str(tmp_path / "accounts.json")
+    store = RecordStore(path)
+    key = store.create("1.2.3.4")
+    store.set(key, 70)
+    store.set("12345/1.2.3.4", 30)
+    store.delete("12345/1.2.3.4")
+    store.close()
+
+    reopened = RecordStore(path)
+    assert reopened.get(key) == 70
+    assert reopened.get("12345/1.2.3.4") is None
+    assert reopened.get(key.split("/")[0] + "/5.6.7.8") is None
+    assert reopened.total() == 70 and reopened.count() == 1
+    assert reopened.verify() == (70, 70, 1, 1)
+    reopened.close()
+
+
+def test_record_store_rejects_total_overflow(tmp_path):
+    """Test: A change that would overflow the total is rejected before any slot is written"""
+    store = RecordStore(str(tmp_path / "accounts.json"))
+    first = store.create("1.2.3.4")
+    second = store.create("1.2.3.4")
+    store.set(first, 2 ** 62)
+
+    with pytest.raises(OverflowError):
+        store.set(second, 2 ** 62)
+    with pytest.raises(OverflowError):
+        store.apply([["S", second, 1], ["S", first, 2 ** 63 - 1]])
+
+    assert store.snapshot() == {first: 2 ** 62, second: 0}
+    assert store.verify() == (2 ** 62, 2 ** 62, 2, 2)
+    store.close()
+
+
+def test_record_store_rejects_keys_of_other_banks(tmp_path):
+    """Test: Setting or removing an account of another IP leaves the table unchanged"""
+    store = RecordStore(str(tmp_path / "accounts.json"))
+    key = store.create("1.2.3.4")
+    store.set(key, 10)
+
+    with pytest.raises(ValueError) as error:
+        store.set(key.split("/")[0] + "/5.6.7.8", 99)
+    store.delete(key.split("/")[0] + "/5.6.7.8")
+    with pytest.raises(ValueError):
+        store.create("5.6.7.8")
+
+    assert not str(error.value).startswith("ER")
+    assert store.snapshot() == {key: 10}
+    store.close()
+
+
+def test_record_store_import_export_roundtrip(tmp_path):
+    """Test: JSON accounts converted to a record file and back are unchanged"""
+    accounts = {"12345/1.2.3.4": 100, "99999/1.2.3.4": 0, "10000/1.2.3.4": 5}
+    source = tmp_path / "accounts.json"
+    source.write_text(json.dumps(accounts))
+
+    assert import_json(str(source), str(tmp_path / "accounts.dat")) == 3
+    assert export_json(str(tmp_path / "accounts.dat"), str(tmp_path / "export.json")) == 3
+    assert json.loads((tmp_path / "export.json").read_text()) == accounts
+    assert not (tmp_path / "accounts.journal").exists()
+
+
+# Tests for SQLiteStore
+def test_sqlite_store_imports_and_tracks_totals(tmp_path):
+    """Test: The database is created from the JSON store and triggers keep BA/BN up to date"""
+    legacy = tmp_path / "accounts.json"
+    legacy.write_text(json.dumps({"12345/1.2.3.4": 100}))
+    store = SQLiteStore(str(legacy))
+
+    key = store.create("1.2.3.4")
+    store.set(key, 50)
+    store.delete("12345/1.2.3.4")
+
+    assert store.get(key) == 50
+    assert store.get("12345/1.2.3.4") is None
+    assert (store.total(), store.count()) == (50, 1)
+    assert store.verify() == (50, 50, 1, 1)
+    store.close()
+
+
+def test_sqlite_store_batch_is_one_transaction(tmp_path):
+    """Test: A failing change rolls back the whole batch"""
+    store = SQLiteStore(str(tmp_path / "accounts.json"))
+    store.set("12345/1.2.3.4", 10)
+
+    with pytest.raises(Exception):
+        store.apply([["S", "12345/1.2.3.4", 0], ["S", "54321/1.2.3.4", None]])
+
+    assert store.get("12345/1.2.3.4") == 10
+    assert store.snapshot() == {"12345/1.2.3.4": 10}
+    store.close()
+
+
+# Tests for GroupCommit
+def test_group_commit_shares_one_sync():
+    """Test: Writers arriving during a sync are made durable together by the next one"""
+    group_commit = GroupCommit(window=1.0, max_batch=7)
+    syncs = []
+
+    def sync():
+        syncs.append(1)
+        time.sleep(0.2)
+
+    first = threading.Thread(target=group_commit.wait, args=(sync,))
+    first.start()
+    time.sleep(0.05)
+    threads = [threading.Thread(target=group_commit.wait, args=(sync,)) for _ in range(7)]
+    for thread in threads:
+        thread.start()
+    for thread in [first, *threads]:
+        thread.join(timeout=5)
+
+    assert len(syncs) == 2
+    assert group_commit.durable == 8
+
+
+def test_group_commit_lone_writer_does_not_wait():
+    """Test: A writer without others waiting is synced without waiting for the window"""
+    group_commit = GroupCommit(window=10.0)
+    start = time.monotonic()
+
+    group_commit.wait(lambda: None)
+
+    assert time.monotonic() - start < 1.0
+
+
+def test_store_waits_for_fsync(tmp_path):
+    """Test: With group commit a journal write returns only after an fsync"""
+    store = AccountStore(str(tmp_path / "accounts.json"), group_commit=GroupCommit(window=0))
+    store.sync()
+
+    with patch("storage.os.fsync") as fsync:
+        store.set("12345/1.2.3.4", 10)
+
+    assert fsync.call_count == 1
+    store.close()
+
+
+def test_sqlite_store_group_commit_fsyncs_wal(tmp_path):
+    """Test: With group commit concurrent SQLite commits share fsyncs of the WAL"""
+    metrics = MagicMock()
+    store = SQLiteStore(str(tmp_path / "accounts.json"), group_commit=GroupCommit(window=0.05, metrics=metrics))
+    store.sync()
+
+    def deposit(number):
+        store.sync()
+        for _ in range(5):
+            store.set(f"{number}/1.2.3.4", 10)
+
+    threads = [threading.Thread(target=deposit, args=(10000 + i,)) for i in range(8)]
+    with patch("sqlite_store.os.fsync", side_effect=lambda fd: time.sleep(0.01)) as fsync:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+
+    fsyncs = [c for c in metrics.observe.call_args_list if c.args[0] == "storage.fsync"]
+    assert 0 < fsync.call_count == len(fsyncs) < 40
+    assert store.connections[0].execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert store.count() == 8
+    store.close()
+
+
+# Tests for the async server
+def _run_async_client(commands, payload):
+    async def scenario():
+        server = await asyncio.start_server(
+            lambda r, w: async_server.serve_client(r, w, commands), host="127.0.0.1", port=0
+        )
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            if payload:
+                writer.write(payload)
+            data = await asyncio.wait_for(reader.read(1024), 2)
+            writer.close()
+            return data
+
+    return asyncio.run(scenario())
+
+
+def test_async_server_executes_command():
+    """Test: Command is dispatched through Commands and the response is written back"""
+    commands = MagicMock()
+    commands.execute.side_effect = lambda msg, conn, addr: conn.sendall(f"{msg} OK\r\n".encode())
+
+    data = _run_async_client(commands, b"BC\r\n")
+
+    assert data == b"BC OK\r\n"
+
+
+def test_async_server_timeout(monkeypatch):
+    """Test: Inactive client receives the TIMEOUT notice"""
+    monkeypatch.setattr(async_server, "CLIENT_TIMEOUT", 0.1)
+
+    data = _run_async_client(MagicMock(), None)
+
+    assert b"TIMEOUT" in data
+
+
+
+# Tests for the worker pool
+def test_worker_pool_size_from_config(monkeypatch):
+    """Test: Configured worker count is used, 0 means one per CPU core"""
+    monkeypatch.setattr(worker_pool, "WORKERS", 3)
+    expected = 3 if hasattr(socket, "SO_REUSEPORT") else 1
+    assert worker_pool.pool_size() == expected
+
+    monkeypatch.setattr(worker_pool, "WORKERS", 0)
+    with patch('worker_pool.os.cpu_count', return_value=8):
+        expected = 8 if hasattr(socket, "SO_REUSEPORT") else 1
+        assert worker_pool.pool_size() == expected
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="SO_REUSEPORT not available")
+def test_worker_listeners_share_port():
+    """Test: Two workers can listen on the same port"""
+    first = worker_pool.create_listener("127.0.0.1", 0, reuse_port=True)
+    port = first.getsockname()[1]
+    second = worker_pool.create_listener("127.0.0.1", port, reuse_port=True)
+
+    assert second.getsockname()[1] == port
+    first.close()
+    second.close()
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="SO_REUSEPORT not available")
+def test_worker_pool_fails_fast_on_port_in_use():
+    """Test: The pool raises before starting workers if another pool listens on the port"""
+    other = worker_pool.create_listener("127.0.0.1", 0, reuse_port=True)
+    port = other.getsockname()[1]
+    ready = MagicMock()
+
+    with patch('worker_pool.start_worker') as start_worker:
+        with pytest.raises(OSError):
+            worker_pool.run_worker_pool(StripedLock(8), "127.0.0.1", port, ready=ready)
+
+    start_worker.assert_not_called()
+    ready.assert_not_called()
+    other.close()
+
+
+
+# Tests for the headless server
+@pytest.mark.skipif(sys.platform == "win32", reason="SIGTERM drain is POSIX only")
+def test_headless_server_signals_ready_and_drains(tmp_path):
+    """Test: The headless server reports readiness, answers and exits cleanly on SIGTERM"""
+    config = dict(CONFIG, port=0, bank_ip="127.0.0.1", log_dir=str(tmp_path / "log"))
+    (tmp_path / "config.json").write_text(json.dumps(config))
+    pidfile = tmp_path / "server.pid"
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(src_path, "server.py"), "--pidfile", str(pidfile)],
+        cwd=tmp_path,
+        env=dict(os.environ, P2P_CONFIG=str(tmp_path / "config.json")),
+        stdout=subprocess.PIPE,
+        text=True
+    )
+    try:
+        ready = server.stdout.readline().split()
+        assert ready[0] == "READY" and pidfile.read_text().strip() == ready[2]
+
+        host, port = ready[1].rsplit(":", 1)
+        with socket.create_connection((host, int(port)), timeout=5) as client:
+            client.sendall(b"BC\r\n")
+            assert client.recv(1024) == b"BC 127.0.0.1\r\n"
+
+            server.send_signal(signal.SIGTERM)
+            assert server.wait(timeout=10) == 0
+            assert client.recv(1024) == b""
+        assert not pidfile.exists()
+    finally:
+        if server.poll() is None:
+            server.kill()
+
+
+def test_headless_server_imports_only_what_it_needs(tmp_path):
+    """Test: Importing the headless server loads no unused store backend or profiler"""
+    code = (
+        "import sys; import server; "
+        "print(' '.join(m for m in ('sqlite3', 'mmap', 'cProfile', 'pstats', 'tkinter') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env=dict(os.environ, PYTHONPATH=src_path),
+        capture_output=True,
+        text=True,
+        timeout=30
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+
+
+# Tests for PeerPool
+def _echo_peer():
+    """Starts a peer that answers every line with 'OK <n>' on one connection."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    accepted = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            accepted.append(conn)
+            with conn:
+                lines = LineBuffer()
+                count = 0
+                while True:
+                    data = conn.recv(1024)
+                    if not data:
+                        break
+                    for _ in lines.feed(data):
+                        count += 1
+                        conn.sendall(f"OK {count}\r\n".encode())
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener, accepted
+
+
+def test_peer_pool_reuses_connection():
+    """Test: Consecutive forwards to one peer share a single TCP connection"""
+    listener, accepted = _echo_peer()
+    port = listener.getsockname()[1]
+    pool = PeerPool(max_per_peer=2, idle_timeout=30, timeout=1.0)
+
+    assert pool.request("127.0.0.1", port, "AB 1") == "OK 1"
+    assert pool.request("127.0.0.1", port, "AB 1") == "OK 2"
+    assert len(accepted) == 1
+
+    pool.close()
+    listener.close()
+
+
+def test_peer_pool_evicts_idle_connections():
+    """Test: Connections idle longer than idle_timeout are closed"""
+    listener, accepted = _echo_peer()
+    port = listener.getsockname()[1]
+    pool = PeerPool(max_per_peer=2, idle_timeout=0, timeout=1.0)
+
+    pool.request("127.0.0.1", port, "AB 1")
+    pool.evict_idle()
+
+    assert pool.idle[("127.0.0.1", port)] == []
+    pool.close()
+    listener.close()
+
+
+
+# Tests for PortDiscovery
+def test_discovery_probes_ports_and_caches():
+    """Test: Probe finds the listening port among the candidates and remembers it"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+
+    discovery = PortDiscovery(range(port - 3, port + 3), timeout=1.0)
+    found = discovery.probe("127.0.0.1")
+
+    assert found is not None and found[0] == port
+    assert discovery.lookup("127.0.0.1") == port
+    found[1].close()
+    listener.close()
+
+
+def test_discovery_negative_cache():
+    """Test: Peer without a listening port is cached as dead"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+
+    discovery = PortDiscovery([port], dead_ttl=60, timeout=0.5)
+
+    assert discovery.probe("127.0.0.1") is None
+    assert discovery.is_dead("127.0.0.1")
+    listener.close()
+
+
+def test_forward_marks_reset_peer_dead(monkeypatch):
+    """Test: A reset peer connection answers ER Bank unreachable and the peer is not retried"""
+    discovery = PortDiscovery([65000], dead_ttl=60)
+    discovery.remember("10.0.0.9", 65000)
+    pool = MagicMock()
+    pool.request_many.side_effect = ConnectionResetError(104, "Connection reset by peer")
+    monkeypatch.setattr(command, "DISCOVERY", discovery)
+    monkeypatch.setattr(command, "PEER_POOL", pool)
+
+    assert command.forward_lines("10.0.0.9", ["AB 12345/10.0.0.9"]) == ["ER Bank unreachable"]
+    assert discovery.lookup("10.0.0.9") is None and discovery.is_dead("10.0.0.9")
+
+
+
+# Tests for BankIdentity
+def test_identity_pinned_ip_skips_detection():
+    """Test: IP pinned in the config is used without opening a socket"""
+    identity = BankIdentity(pinned="10.0.0.5")
+
+    with patch('identity.resolve_local_ip') as resolve:
+        assert identity.get() == "10.0.0.5"
+        resolve.assert_not_called()
+
+
+def test_identity_resolves_once(monkeypatch):
+    """Test: IP is resolved once, shared through the environment and refreshed on demand"""
+    monkeypatch.setenv(BANK_IP_ENV, "")
+    monkeypatch.delenv(BANK_IP_ENV)
+    identity = BankIdentity(check_interval=0)
+
+    with patch('identity.resolve_local_ip', side_effect=["10.0.0.1", "10.0.0.2"]) as resolve:
+        assert identity.get() == "10.0.0.1"
+        assert identity.get() == "10.0.0.1"
+        assert resolve.call_count == 1
+        assert os.environ[BANK_IP_ENV] == "10.0.0.1"
+
+        assert identity.refresh() == "10.0.0.2"
+
+
+
+# Tests for LogWriter
+def test_log_writer_keeps_order_and_flushes_on_close(tmp_path):
+    """Test: All records are written in order when the writer is closed"""
+    path = tmp_path / "bank.log"
+    writer = LogWriter(str(path), flush_interval=0.01, batch_size=7)
+
+    for i in range(100):
+        writer.write(f"line {i}\n")
+    writer.close()
+
+    assert path.read_text().splitlines() == [f"line {i}" for i in range(100)]
+
+
+def test_log_writer_rotates_by_size(tmp_path):
+    """Test: Log file is rotated after reaching max_bytes"""
+    path = tmp_path / "bank.log"
+    writer = LogWriter(str(path), flush_interval=0.01, batch_size=1, max_bytes=20, backups=2)
+
+    for i in range(6):
+        writer.write(f"record number {i}\n")
+    writer.close()
+
+    assert (tmp_path / "bank.log.1").exists()
+    assert (tmp_path / "bank.log.2").exists()
+    assert not (tmp_path / "bank.log.3").exists()
+
+
+def test_log_writer_drop_policy():
+    """Test: Full queue drops records under the drop policy"""
+    writer = LogWriter("unused.log", queue_size=1, policy="drop")
+    writer.pid = os.getpid()
+    writer.thread = MagicMock()
+    writer.queue = queue.Queue(maxsize=1)
+
+    writer.write("a\n")
+    writer.write("b\n")
+
+    assert writer.dropped == 1
+
+
+
+# Tests for LogTail
+def test_log_tail_reads_only_appended_lines(tmp_path):
+    """Test: Polls return new complete lines, a partial line waits for its end"""
+    path = tmp_path / "bank.log"
+    path.write_bytes(b"one\ntwo\nthr")
+    tail = LogTail(str(path), window=10)
+
+    assert tail.poll() == (["one", "two"], False, False)
+    with open(path, "ab") as f:
+        f.write(b"ee\nfour\n")
+    assert tail.poll() == (["three", "four"], False, False)
+    assert tail.poll() == ([], False, False)
+    tail.close()
+
+
+def test_log_tail_pages_and_follows_rotation(tmp_path):
+    """Test: Older lines are read through the index, a rotated file is followed from its start"""
+    path = tmp_path / "bank.log"
+    path.write_text("".join(f"line {i}\n" for i in range(250)))
+    tail = LogTail(str(path), window=20)
+
+    lines, replace, _ = tail.poll()
+    assert replace and lines[0] == "line 230" and len(lines) == 20
+    assert tail.read_lines(105, 3) == ["line 105", "line 106", "line 107"]
+
+    with open(path, "a") as f:
+        f.write("last old\n")
+    os.replace(path, tmp_path / "bank.log.1")
+    path.write_text("new 0\n")
+
+    assert tail.poll() == (["last old", "new 0"], False, False)
+    assert tail.read_lines(0) == ["new 0"]
+    tail.close()
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_log_tail_does_not_keep_the_file_open(tmp_path):
+    """Test: The log file is closed between polls, so the writer can rotate it"""
+    path = tmp_path / "bank.log"
+    path.write_text("one\n")
+    tail = LogTail(str(path), window=10)
+
+    assert tail.poll() == (["one"], False, False)
+    assert tail.read_lines(0) == ["one"]
+
+    open_files = [os.path.realpath(os.path.join("/proc/self/fd", fd)) for fd in os.listdir("/proc/self/fd")]
+    assert str(path.resolve()) not in open_files
+
+
+# Tests for account locking
+@pytest.fixture
+def local_commands(tmp_path, monkeypatch):
+    """Fixture: Commands working on an empty store in a temporary directory."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(command, "LOG_DIR", str(tmp_path / "log"))
+    commands = Commands(StripedLock(8))
+    commands.logger = MagicMock()
+    commands.metrics_file = str(tmp_path / "metrics.json")
+    commands.get_my_ip = lambda: "10.0.0.1"
+    yield commands
+    commands.close()
+
+
+def run_command(commands, message):
+    buffer = ResponseBuffer()
+    commands.execute(message, buffer, addr="TEST")
+    return bytes(buffer.response).decode().strip()
+
+
+def test_striped_lock_is_stable_per_key():
+    """Test: The same key always maps to the same stripe"""
+    lock = StripedLock(8)
+    assert lock.for_key("12345/10.0.0.1") is lock.for_key("12345/10.0.0.1")
+    assert StripedLock(0).for_key("12345/10.0.0.1") is not None
+
+
+def test_concurrent_withdrawals_never_overdraw(local_commands):
+    """Test: Parallel withdrawals from one account cannot overdraw it"""
+    key = run_command(local_commands, "AC").split()[1]
+    run_command(local_commands, f"AD {key} 100")
+
+    results = []
+
+    def withdraw():
+        for _ in range(10):
+            results.append(run_command(local_commands, f"AW {key} 7"))
+
+    threads = [threading.Thread(target=withdraw) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results.count("AW") == 14
+    assert run_command(local_commands, f"AB {key}") == "AB 2"
+    assert run_command(local_commands, "BA") == "BA 2"
+
+
+
+# Tests for running aggregates
+def test_store_aggregates_follow_mutations(tmp_path):
+    """Test: Total and count are maintained by create, deposit, withdraw and remove"""
+    store = AccountStore(str(tmp_path / "accounts.json"))
+    store.set("12345/1.2.3.4", 0)
+    store.set("12345/1.2.3.4", 70)
+    store.set("54321/1.2.3.4", 30)
+    store.set("54321/1.2.3.4", 0)
+    store.delete("54321/1.2.3.4")
+
+    assert store.total() == 70
+    assert store.count() == 1
+    assert store.verify() == (70, 70, 1, 1)
+    store.close()
+
+
+def test_verify_reports_drift(local_commands):
+    """Test: BA VERIFY reports a running total that drifted from the accounts"""
+    key = run_command(local_commands, "AC").split()[1]
+    run_command(local_commands, f"AD {key} 50")
+    local_commands.store.balance_total += 5
+
+    assert run_command(local_commands, "BA VERIFY").startswith("ER Total drift")
+    assert run_command(local_commands, "BA") == "BA 50"
+    assert run_command(local_commands, "BN VERIFY") == "BN 1"
+
+
+
+# Tests for NumberAllocator
+def test_allocator_reclaims_and_exhausts():
+    """Test: Numbers are unique, reserved numbers are skipped and released ones are reused"""
+    allocator = NumberAllocator([10001, 10002, 10003])
+    allocator.reserve(10002)
+
+    taken = {allocator.take(), allocator.take()}
+    assert taken == {10001, 10003}
+
+    with pytest.raises(AccountSpaceExhaustedError):
+        allocator.take()
+
+    allocator.release(10003)
+    assert allocator.take() == 10003
+
+
+def test_store_persists_free_numbers(tmp_path):
+    """Test: Allocator state survives a restart and skips existing accounts"""
+    path = str(tmp_path / "accounts.json")
+    store = AccountStore(path, compact_every=1)
+    key = store.create("1.2.3.4")
+    free_before = len(store.allocator)
+    store.close()
+
+    recovered = AccountStore(path)
+    recovered.sync()
+
+    assert len(recovered.allocator) == free_before
+    assert int(key.split("/")[0]) not in recovered.allocator.index
+    recovered.close()
+
+
+
+# Tests for batch command
+def test_batch_best_effort(local_commands):
+    """Test: Best-effort batch applies the items that succeed and reports each result"""
+    key = run_command(local_commands, "AC").split()[1]
+
+    res = run_command(local_commands, f"BT BEST AD {key} 100; AW {key} 500; AW {key} 30; AB {key}")
+
+    assert res == "BT AD; ER Insufficient funds.; AW; AB 70"
+    assert run_command(local_commands, "BA") == "BA 70"
+
+
+def test_batch_atomic_rolls_back(local_commands):
+    """Test: Atomic batch with a failing item changes nothing"""
+    key = run_command(local_commands, "AC").split()[1]
+    run_command(local_commands, f"AD {key} 10")
+
+    res = run_command(local_commands, f"BT ATOMIC AD {key} 100; AW {key} 500")
+
+    assert res == "BT ER Not applied, batch rolled back.; ER Insufficient funds."
+    assert run_command(local_commands, f"AB {key}") == "AB 10"
+
+
+def test_batch_groups_remote_items_per_bank(local_commands):
+    """Test: Items for another bank are forwarded as one batch"""
+    local_commands.forward_command = MagicMock(return_value="BT AD; AB 5")
+
+    res = run_command(local_commands, "BT BEST AD 11111/10.0.0.9 5; AB 11111/10.0.0.9")
+
+    assert res == "BT AD; AB 5"
+    local_commands.forward_command.assert_called_once_with(
+        "10.0.0.9", "BT BEST AD 11111/10.0.0.9 5; AB 11111/10.0.0.9"
+    )
+
+
+def test_batch_falls_back_only_for_banks_without_bt(local_commands):
+    """Test: Items are re-sent one by one only if the bank does not know BT"""
+    local_commands.forward_command = MagicMock(return_value="ER Application error: disk full")
+    res = run_command(local_commands, "BT BEST AD 11111/10.0.0.9 5; AB 11111/10.0.0.9")
+
+    assert res == "BT ER Application error: disk full; ER Application error: disk full"
+    assert local_commands.forward_command.call_count == 1
+
+    local_commands.forward_command = MagicMock(side_effect=["ER Unknown command", "AD", "AB 5"])
+    res = run_command(local_commands, "BT BEST AD 11111/10.0.0.9 5; AB 11111/10.0.0.9")
+
+    assert res == "BT AD; AB 5"
+
+
+
+# Tests for the balance cache
+def test_balance_cache_rejects_reads_older_than_invalidation():
+    """Test: An answer read before an invalidation is not cached"""
+    cache = BalanceCache(ttl=60)
+    version = cache.version("12345/10.0.0.2")
+    cache.invalidate("12345/10.0.0.2")
+    cache.put("12345/10.0.0.2", "AB 100", version)
+    assert cache.get("12345/10.0.0.2") is None
+
+    cache.put("12345/10.0.0.2", "AB 50", cache.version("12345/10.0.0.2"))
+    assert cache.get("12345/10.0.0.2") == "AB 50"
+
+
+def test_remote_balance_cached_until_forwarded_deposit(local_commands, monkeypatch):
+    """Test: Repeated remote AB hit the cache, a forwarded AD or FRESH asks the bank again"""
+    monkeypatch.setattr(command, "BALANCE_CACHE", BalanceCache(ttl=60))
+    sent = []
+
+    def fake_forward(target_ip, commands):
+        sent.extend(commands)
+        return ["AD" if c.startswith("AD") else f"AB {len(sent)}" for c in commands]
+
+    monkeypatch.setattr(command, "forward_lines", fake_forward)
+    monkeypatch.setattr(command, "FORWARDER", None)
+
+    assert run_command(local_commands, "AB 12345/10.0.0.2") == "AB 1"
+    assert run_command(local_commands, "AB 12345/10.0.0.2") == "AB 1"
+    assert run_command(local_commands, "AB 12345/10.0.0.2 FRESH") == "AB 2"
+    run_command(local_commands, "AD 12345/10.0.0.2 5")
+    assert run_command(local_commands, "AB 12345/10.0.0.2") == "AB 4"
+    assert sent == ["AB 12345/10.0.0.2"] * 2 + ["AD 12345/10.0.0.2 5", "AB 12345/10.0.0.2"]
+
+
+# Tests for Forwarder
+def test_forwarder_coalesces_requests_per_bank():
+    """Test: Concurrent forwards to one bank share one pipelined send and get their own responses"""
+    batches = []
+
+    def send(ip, commands):
+        batches.append(list(commands))
+        return [f"OK {c}" for c in commands]
+
+    forwarder = Forwarder(send, window=0.1, max_batch=10, timeout=2.0)
+    results = {}
+
+    def submit(n):
+        results[n] = forwarder.submit("10.0.0.9", f"AB {n}")
+
+    threads = [threading.Thread(target=submit, args=(n,)) for n in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == {n: f"OK AB {n}" for n in range(5)}
+    assert sum(len(b) for b in batches) == 5
+    assert len(batches) < 5
+
+
+def test_forwarder_request_timeout():
+    """Test: A caller gives up after its timeout"""
+    release = threading.Event()
+
+    def send(ip, commands):
+        release.wait(2)
+        return ["OK"] * len(commands)
+
+    forwarder = Forwarder(send, window=0, timeout=0.1)
+
+    assert forwarder.submit("10.0.0.9", "AB 1") == "ER Bank unreachable"
+    release.set()
+
+
+
+# Tests for the binary protocol
+def test_binary_request_and_response_roundtrip():
+    """Test: Commands and responses survive binary encoding"""
+    buffer = bytearray(binary_protocol.encode_request("AD 12345/10.0.0.1 250"))
+    opcode, text = binary_protocol.decode_request(binary_protocol.next_frame(buffer))
+    assert text == "AD 12345/10.0.0.1 250"
+
+    for command in ["AD 012345/10.0.0.1 5", "AB 12345/10.1", "AB 12345/010.0.0.1", "AD 12345/10.0.0.1 +5"]:
+        buffer = bytearray(binary_protocol.encode_request(command))
+        assert binary_protocol.decode_request(binary_protocol.next_frame(buffer)) == (binary_protocol.OPCODES["TX"], command)
+
+    for response in ["AB 250", "AC 12345/10.0.0.1", "BC 10.0.0.1", "AD", "ER Insufficient funds."]:
+        cmd = response.split()[0] if not response.startswith("ER") else "AW"
+        frame = bytearray(binary_protocol.encode_response(binary_protocol.OPCODES[cmd], response))
+        assert binary_protocol.decode_response(binary_protocol.next_frame(frame)) == response
+
+
+def test_session_negotiates_binary(local_commands):
+    """Test: After BP 1 the session answers binary frames"""
+    session = Session()
+    key = run_command(local_commands, "AC").split()[1]
+    data = b"BP 1\r\n" + binary_protocol.encode_request(f"AD {key} 40") + binary_protocol.encode_request(f"AB {key}")
+
+    response = bytearray(session.process(local_commands, data, "TEST"))
+
+    assert response.startswith(b"BP 1\r\n")
+    del response[:6]
+    assert binary_protocol.decode_response(binary_protocol.next_frame(response)) == "AD"
+    assert binary_protocol.decode_response(binary_protocol.next_frame(response)) == "AB 40"
+
+
+def test_session_answers_malformed_frames(local_commands):
+    """Test: A truncated frame gets an ER, later frames and large responses are still answered"""
+    session = Session()
+    key = run_command(local_commands, "AC").split()[1]
+    truncated = binary_protocol.frame(bytes([binary_protocol.OPCODES["AD"]]))
+    data = b"BP 1\r\n" + truncated + binary_protocol.encode_request(f"AB {key}")
+
+    response = bytearray(session.process(local_commands, data, "TEST"))
+    del response[:6]
+    assert binary_protocol.decode_response(binary_protocol.next_frame(response)) == "ER Malformed frame."
+    assert binary_protocol.decode_response(binary_protocol.next_frame(response)) == "AB 0"
+
+    large = "BT " + " ".join(["x"] * 40000)
+    frame = bytearray(binary_protocol.encode_response(binary_protocol.OPCODES["TX"], large))
+    assert binary_protocol.decode_response(binary_protocol.next_frame(frame)) == large
+
+
+
+# Tests for metrics
+def test_histogram_percentiles():
+    """Test: Percentiles are reported as bucket upper bounds"""
+    histogram = Histogram()
+    for _ in range(99):
+        histogram.observe(0.0008)
+    histogram.observe(0.3)
+
+    assert histogram.count() == 100
+    assert histogram.percentile(0.50) == 0.001
+    assert histogram.percentile(0.999) == 0.5
+
+
+def test_stats_command_reports_commands(local_commands):
+    """Test: ST reports per-command outcomes merged into the shared metrics file"""
+    key = run_command(local_commands, "AC").split()[1]
+    run_command(local_commands, f"AW {key} 10")
+
+    res = run_command(local_commands, "ST")
+
+    assert res.startswith("ST ")
+    stats = json.loads(res[3:])
+    assert stats["cmd.AC.OK"]["count"] >= 1
+    assert stats["cmd.AW.ER"]["count"] >= 1
+    assert "lock.wait" in stats and "storage.io" in stats
+
+
+def test_stats_group_invalid_peer_addresses(local_commands, monkeypatch):
+    """Test: Forwards to junk addresses share one histogram instead of one per address"""
+    monkeypatch.setattr(command, "FORWARDER", None)
+    monkeypatch.setattr(command, "forward_lines", lambda ip, commands: ["ER Bank unreachable"] * len(commands))
+
+    for target in ["xyz1", "xyz2", "010.0.0.1", "10.0.0.9"]:
+        local_commands.forward_command(target, f"AB 12345/{target}")
+
+    stats = json.loads(run_command(local_commands, "ST")[3:])
+    assert stats["peer.other.ER"]["count"] == 3
+    assert stats["peer.10.0.0.9.ER"]["count"] == 1
+    assert not any("xyz" in name for name in stats)
+
+
+def test_stats_start_empty_after_reset(local_commands):
+    """Test: Resetting at server start drops the statistics of earlier runs"""
+    run_command(local_commands, "BN")
+    run_command(local_commands, "ST")
+
+    local_commands.reset_metrics()
+
+    stats = json.loads(run_command(local_commands, "ST")[3:])
+    assert "cmd.BN.OK" not in stats
+
+
+# Tests for profiling
+def test_profiler_merges_profiles(tmp_path):
+    """Test: A started window profiles the block and REPORT merges it into a text report"""
+    profiler = Profiler(str(tmp_path))
+    profiler.start(60)
+
+    with profiler.profile():
+        sorted(range(1000), reverse=True)
+
+    path = profiler.report()
+
+    assert path == str(tmp_path / "report.txt")
+    assert (tmp_path / f"{os.getpid()}.prof").exists()
+    with open(path) as f:
+        assert "Merged profiles of 1 process(es)" in f.read()
+
+    profiler.stop()
+    assert not profiler.active()
+
+
+def test_profiler_skips_unavailable_and_empty_profiles(tmp_path, monkeypatch):
+    """Test: A block whose profiler cannot be enabled still runs, empty profiles are not dumped"""
+    class BusyProfile(cProfile.Profile):
+        def enable(self, *args, **kwargs):
+            raise ValueError("Another profiling tool is already active")
+
+    profiler = Profiler(str(tmp_path))
+    profiler.start(60)
+    monkeypatch.setattr(cProfile, "Profile", BusyProfile)
+
+    with profiler.profile():
+        result = sum(range(10))
+
+    assert result == 45
+    assert profiler.report() is None
+    profiler.stop()
+
+
+def test_slow_command_logged_with_breakdown(local_commands, monkeypatch):
+    """Test: Commands over the threshold are logged as SLOW with lock and storage times"""
+    monkeypatch.setattr(command, "SLOW_COMMAND_MS", 1e-9)
+
+    key = run_command(local_commands, "AC").split()[1]
+    run_command(local_commands, f"AD {key} 10")
+
+    slow = [c.args[0] for c in local_commands.logger.write.call_args_list if "[SLOW]" in c.args[0]]
+    assert len(slow) == 2
+    assert f"AD {key} 10 took" in slow[1]
+    assert "lock.wait" in slow[1] and "storage.io" in slow[1]
+
+
+# Tests for admission control
+def test_gate_queues_then_rejects():
+    """Test: Over the limit callers wait in the queue, a full queue or a timeout rejects them"""
+    gate = Gate(1, queue_size=1, timeout=0.05)
+    assert gate.try_enter()
+    assert gate.join_queue()
+    assert not gate.join_queue()
+    assert not gate.try_enter()
+
+    gate.leave()
+    assert gate.try_enter(queued=True)
+    gate.leave_queue()
+    assert not gate.enter()
+    assert gate.status() == {"active": 1, "limit": 1, "waiting": 0, "rejected": 2}
+
+
+def test_async_server_refuses_over_limit(tmp_path, monkeypatch):
+    """Test: A connection over the limit gets the busy response, LD reports the load"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(command, "LOG_DIR", str(tmp_path / "log"))
+    admission = Admission(max_connections=1, queue_size=0)
+
+    async def scenario():
+        ready = asyncio.get_running_loop().create_future()
+        server = asyncio.create_task(async_server.serve(
+            StripedLock(8), "127.0.0.1", 0, ready=lambda h, p: ready.set_result(p), admission=admission))
+        port = await ready
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"LD\r\n")
+        load = json.loads((await reader.readline()).decode().split(" ", 1)[1])
+
+        other_reader, other_writer = await asyncio.open_connection("127.0.0.1", port)
+        busy = await other_reader.readline()
+        other_writer.close()
+        writer.close()
+        server.cancel()
+        return load, busy
+
+    load, busy = asyncio.run(scenario())
+    assert load["connections"]["active"] == 1
+    assert busy.decode().strip() == BUSY
+    assert admission.connections.status()["rejected"] == 1